@@ -0,0 +1,48 @@
+import io
+import sys
+import json
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+
+
+READY = 'script-worker 1'
+
+
+def _exit_status(ex):
+    if ex.code is None:
+        return 0
+    if isinstance(ex.code, int):
+        return ex.code
+    print(ex.code)
+    return 1
+
+
+def serve(main):
+    stdin, stdout = sys.stdin, sys.stdout
+    argv0 = sys.argv[0]
+    stdout.write(READY + '\n')
+    stdout.flush()
+    for line in stdin:
+        sys.argv = [argv0] + json.loads(line)
+        output = io.StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                main()
+                status = 0
+            except SystemExit as ex:
+                status = _exit_status(ex)
+            except Exception:
+                traceback.print_exc()
+                status = 1
+        stdout.write(json.dumps({
+            'status': status,
+            'output': output.getvalue()
+        }) + '\n')
+        stdout.flush()
+
+
+def run(main):
+    if sys.argv[1:] == ['--serve']:
+        serve(main)
+    else:
+        main()
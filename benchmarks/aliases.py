@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import random
+import string
+from timeit import timeit
+from argparse import ArgumentParser
+
+sys.path.insert(0, '.')
+
+from bot.util import RegexReplace
+from bot.safe_regex import RegexWorker
+
+
+def random_word(length=8):
+    return ''.join(random.choice(string.ascii_lowercase) for _ in range(length))
+
+def random_aliases(count):
+    return [
+        (r'\b%s\b' % random_word(), random_word())
+        for _ in range(count)
+    ]
+
+def apply_uncached(aliases, msg):
+    for expr, repl in aliases:
+        msg = re.sub(expr, repl, msg, flags=re.I)
+    return msg
+
+
+def main(args=None):
+    parser = ArgumentParser()
+    parser.add_argument(
+        '-c', '--chats',
+        type=int, default=16,
+        help='number of chats (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-n', '--number',
+        type=int, default=1000,
+        help='messages per alias count (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-t', '--regex-timeout',
+        type=float, default=0.5,
+        help='regex worker timeout (default: %(default)s)'
+    )
+    parser.add_argument(
+        'alias_count',
+        type=int, nargs='*', default=[0, 1, 10, 50, 100],
+        help='aliases per chat (default: 0 1 10 50 100)'
+    )
+    args = parser.parse_args(args)
+
+    msg = ' '.join(random_word() for _ in range(16))
+
+    worker = RegexWorker(args.regex_timeout)
+    worker.search('', msg)
+    print('aliases  uncached (us/msg)  compiled (us/msg)  worker (us/msg)')
+    try:
+        for count in args.alias_count:
+            chats = [random_aliases(count) for _ in range(args.chats)]
+            compiled = [RegexReplace(aliases, re.I) for aliases in chats]
+            workers = [RegexReplace(aliases, re.I, worker) for aliases in chats]
+            uncached = timeit(
+                lambda: [apply_uncached(aliases, msg) for aliases in chats],
+                number=args.number
+            )
+            cached = timeit(
+                lambda: [replace(msg) for replace in compiled],
+                number=args.number
+            )
+            remote = timeit(
+                lambda: [replace(msg) for replace in workers],
+                number=args.number
+            )
+            scale = 1e6 / args.number / args.chats
+            print('%7d  %17.2f  %17.2f  %15.2f' % (
+                count, uncached * scale, cached * scale, remote * scale
+            ))
+    finally:
+        worker.close()
+
+if __name__ == '__main__':
+    main()
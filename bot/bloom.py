@@ -0,0 +1,62 @@
+import re
+import math
+import hashlib
+from threading import Lock
+
+
+class DuplicateFilter:
+    RE_WORD = re.compile(r'\w+')
+
+    def __init__(self, window, error_rate=0.01):
+        if window <= 0:
+            raise ValueError('invalid window size: %r' % window)
+        self.window = window
+        self.size = max(
+            64,
+            int(-window * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / window * math.log(2)))
+        self.lock = Lock()
+        self.current = bytearray((self.size + 7) // 8)
+        self.previous = bytearray(len(self.current))
+        self.count = 0
+        self.checked = 0
+        self.suppressed = 0
+
+    def normalize(self, text):
+        return ' '.join(self.RE_WORD.findall(text.lower()))
+
+    def _indexes(self, text):
+        digest = hashlib.blake2b(
+            self.normalize(text).encode('utf-8'), digest_size=16
+        ).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    @staticmethod
+    def _test(bits, indexes):
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in indexes)
+
+    def check(self, text):
+        indexes = self._indexes(text)
+        with self.lock:
+            self.checked += 1
+            if (self._test(self.current, indexes)
+                    or self._test(self.previous, indexes)):
+                self.suppressed += 1
+                return True
+            if self.count >= self.window:
+                self.previous = self.current
+                self.current = bytearray(len(self.previous))
+                self.count = 0
+            for i in indexes:
+                self.current[i >> 3] |= 1 << (i & 7)
+            self.count += 1
+            return False
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'suppressed': self.suppressed
+        }
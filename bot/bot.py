@@ -1,11 +1,15 @@
+import os
+import json
 import logging
-from queue import Queue
-from threading import Event
+from time import time
+from queue import Queue, Empty
+from threading import Event, Lock
 from functools import partial
+from collections import deque
 
-from pony.orm import db_session
+from pony.orm import db_session, rollback
 
-from telegram import ParseMode
+from telegram import ParseMode, Update
 from telegram.ext import (
     Updater,
     MessageHandler,
@@ -15,8 +19,12 @@ from telegram.ext.filters import Filters
 
 from .error import CommandError
 from .state import BotState
+from .context_cache import ContextCache
+from .search import Search
+from .script_pool import ScriptPool
+from .models import clear_caches
 from .commands import BotCommands
-from .promise import Promise, PromiseType as PT
+from .promise import Promise, PromiseType as PT, PromiseState as PS
 from .util import (
     update_handler,
     download_file,
@@ -28,20 +36,45 @@ from .util import (
 
 class Bot:
     LOG_FORMAT = '[%(asctime).19s] [%(name)s] [%(levelname)s] %(message)s'
+    LOG_OVERFLOW = ('block', 'drop', 'spill')
 
-    def __init__(self, tokens, proxy=None, root=None):
+    def __init__(self, tokens, proxy=None, root=None,
+                 batch_size=1, batch_latency=0.05,
+                 log_buffer=0, log_overflow='block',
+                 context_cache_size=ContextCache.MAX_SIZE_DEFAULT,
+                 context_cache_ttl=None,
+                 learn_workers=0,
+                 script_workers=ScriptPool.WORKERS_DEFAULT,
+                 filter_workers=None,
+                 search_rate=Search.RATE_DEFAULT,
+                 search_burst=Search.BURST_DEFAULT):
         if not tokens:
             raise ValueError('no tokens')
+        if log_overflow not in self.LOG_OVERFLOW:
+            raise ValueError('invalid log overflow policy: %s' % log_overflow)
 
         self.logger = logging.getLogger('bot.info')
         self.logger.info(
-            'init: tokens=%s proxy=%s root=%s',
-            tokens, proxy, root
+            'init: tokens=%s proxy=%s root=%s batch=%d/%f',
+            tokens, proxy, root, batch_size, batch_latency
         )
 
         self.tokens = [token.strip() for token in tokens]
         self.proxy = proxy.strip() if proxy is not None else None
         self.queue = Queue()
+        self.batch_size = batch_size
+        self.batch_latency = batch_latency
+        self.log_buffer = log_buffer
+        self.log_overflow = log_overflow
+        self.log_lock = Lock()
+        self.log_pending = deque()
+        self.log_stats = {
+            'logged': 0,
+            'blocked': 0,
+            'dropped': 0,
+            'spilled': 0,
+            'max_pending': 0
+        }
         self.stopped = Event()
 
         self.updaters = [
@@ -55,7 +88,31 @@ class Bot:
         me = self.primary.bot.get_me()
         self.logger.info('get_me: %s', me)
 
-        self.state = BotState(self, me.id, me.username, root, proxy=self.proxy)
+        self.state = BotState(
+            self, me.id, me.username, root,
+            proxy=self.proxy,
+            context_cache_size=context_cache_size,
+            context_cache_ttl=context_cache_ttl,
+            learn_workers=learn_workers,
+            script_workers=script_workers,
+            filter_workers=filter_workers,
+            search_rate=search_rate,
+            search_burst=search_burst
+        )
+        self.primary.job_queue.run_repeating(
+            lambda _: self.state.context.flush(False),
+            interval=ContextCache.FLUSH_INTERVAL
+        )
+        self.primary.job_queue.run_repeating(
+            self._refill_pool,
+            interval=ContextCache.POOL_INTERVAL
+        )
+        if context_cache_ttl:
+            self.primary.job_queue.run_repeating(
+                lambda _: self.state.context.expire(),
+                interval=context_cache_ttl
+            )
+        self.spill_path = os.path.join(self.state.root, 'spill.jsonl')
         self.commands = BotCommands(self)
 
         dispatcher = self.primary.dispatcher
@@ -102,42 +159,111 @@ class Bot:
     def save(self):
         self.state.save()
 
+    def get_stats(self):
+        with self.log_lock:
+            stats = dict(self.log_stats)
+            stats['pending'] = len(self.log_pending)
+        stats['buffer'] = self.log_buffer
+        stats['queue'] = self.queue.qsize()
+        ret = {'update log': stats}
+        ret.update(self.state.get_stats())
+        return ret
+
+    def _refill_pool(self, _):
+        if self.queue.empty():
+            self.state.context.refill()
+
     def start_polling(self, interval=0.0):
         self.logger.info('start_polling %f', interval)
+        self.replay_spill()
         for updater in self.updaters:
             updater.start_polling(interval)
         self.main_loop()
 
     def main_loop(self):
         self.logger.info('main loop')
-        promise = None
+        batch = []
         while True:
             try:
-                promise = self.queue.get()
-                if not isinstance(promise, Promise):
-                    self.logger.error(
-                        'main loop: invalid queue item: %s',
-                        promise
-                    )
-                    continue
-                promise.run()
+                batch = self._get_batch()
+                self._run_batch(batch)
             except (KeyboardInterrupt, SystemExit) as ex:
                 self.logger.info(ex)
                 self.logger.info('stopping main loop')
                 try:
-                    if promise is not None:
-                        promise.run()
+                    for promise in batch:
+                        if isinstance(promise, Promise):
+                            promise.run()
                         self.queue.task_done()
-                        promise = None
+                    batch = []
                 finally:
                     self.stop()
                 return
             except Exception as ex:
                 self.logger.error(ex)
             finally:
-                if promise is not None:
+                for _ in batch:
                     self.queue.task_done()
-                    promise = None
+                batch = []
+
+    def _get_batch(self):
+        promise = self.queue.get()
+        batch = [promise]
+        if (self.batch_size <= 1
+                or not isinstance(promise, Promise)
+                or promise.type != PT.BATCH):
+            return batch
+        deadline = time() + self.batch_latency
+        while len(batch) < self.batch_size:
+            try:
+                timeout = deadline - time()
+                if timeout > 0:
+                    promise = self.queue.get(timeout=timeout)
+                else:
+                    promise = self.queue.get_nowait()
+            except Empty:
+                break
+            batch.append(promise)
+            if not isinstance(promise, Promise) or promise.type != PT.BATCH:
+                break
+        return batch
+
+    def _run_batch(self, batch):
+        promises = [
+            promise for promise in batch
+            if isinstance(promise, Promise) and promise.type == PT.BATCH
+        ]
+        if len(promises) > 1:
+            self._commit_batch(promises)
+            batch = batch[len(promises):]
+        for promise in batch:
+            if not isinstance(promise, Promise):
+                self.logger.error('main loop: invalid queue item: %s', promise)
+                continue
+            promise.run()
+
+    def _commit_batch(self, promises):
+        self.logger.debug('main loop: batch %d', len(promises))
+        results = None
+        try:
+            with db_session:
+                results = [promise.call() for promise in promises]
+                if any(state == PS.REJECTED for state, _ in results):
+                    rollback()
+                    results = None
+        except Exception as ex:
+            self.logger.error('main loop: batch commit error: %r', ex)
+            results = None
+        if results is None:
+            clear_caches()
+            self.logger.warning(
+                'main loop: running batch of %d separately', len(promises)
+            )
+            for promise in promises:
+                promise.run()
+        else:
+            for promise, (state, value) in zip(promises, results):
+                promise.settle(state, value)
 
     def stop(self):
         try:
@@ -162,22 +288,88 @@ class Bot:
                         promise = None
         finally:
             self.save()
+            self.state.close()
             for i, updater in enumerate(self.updaters):
                 self.logger.info('stopping updater %d', i)
                 updater.stop()
 
+    def _learn_update(self, update):
+        try:
+            self.state.learn_update(update)
+        except Exception as ex:
+            self.logger.error('log_update: %r: %s', ex, update)
+            raise
+
     def log_update(self, update):
         self.logger.debug('log_update %s', update)
 
-        learn = Promise.wrap(
-            self.state.learn_update,
-            update,
-            ptype=PT.MANUAL
-        )
-        self.queue.put(learn)
-        learn.catch(
-            lambda ex: self.logger.error('log_update: %r: %s', ex, update)
-        ).wait()
+        # handlers expect the chat and user rows to exist,
+        # so updates from unknown chats or users are learned synchronously
+        if self.log_buffer <= 0 or not self.state.is_known(update):
+            learn = Promise.wrap(self._learn_update, update, ptype=PT.BATCH)
+            self.queue.put(learn)
+            learn.wait()
+            return
+
+        while True:
+            with self.log_lock:
+                pending = self.log_pending
+                while pending and pending[0].wait(0):
+                    pending.popleft()
+                if len(pending) < self.log_buffer:
+                    learn = Promise.wrap(
+                        self._learn_update,
+                        update,
+                        ptype=PT.BATCH
+                    )
+                    pending.append(learn)
+                    self.queue.put(learn)
+                    self.log_stats['logged'] += 1
+                    self.log_stats['max_pending'] = max(
+                        self.log_stats['max_pending'], len(pending)
+                    )
+                    return
+                if self.log_overflow == 'drop':
+                    self.log_stats['dropped'] += 1
+                    self.logger.warning('log_update: buffer full: dropped')
+                    return
+                if self.log_overflow == 'spill':
+                    self.log_stats['spilled'] += 1
+                    self.spill_update(update)
+                    return
+                self.log_stats['blocked'] += 1
+                oldest = pending[0]
+            oldest.wait()
+
+    def spill_update(self, update):
+        try:
+            with open(self.spill_path, 'a') as fp:
+                fp.write(update.to_json())
+                fp.write('\n')
+        except (OSError, TypeError, ValueError) as ex:
+            self.logger.error('spill_update: %r: %s', ex, update)
+
+    def replay_spill(self):
+        if not os.path.exists(self.spill_path):
+            return
+        replay = self.spill_path + '.replay'
+        os.replace(self.spill_path, replay)
+        count = 0
+        with open(replay) as fp:
+            for line in fp:
+                try:
+                    update = Update.de_json(json.loads(line), self.primary.bot)
+                except ValueError as ex:
+                    self.logger.error('replay_spill: %r: %r', ex, line)
+                    continue
+                self.queue.put(Promise.wrap(
+                    self.state.learn_update,
+                    update,
+                    ptype=PT.BATCH
+                ))
+                count += 1
+        os.remove(replay)
+        self.logger.info('replay_spill: %d updates', count)
 
     def download_file(self, message, dirs, deferred=None, overwrite=False):
         self.primary.dispatcher.run_async(download_file, message,
@@ -0,0 +1,103 @@
+from time import time
+from threading import RLock
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_size=1024, ttl=None, on_evict=None):
+        if max_size is not None and max_size <= 0:
+            raise ValueError('invalid cache size: %r' % max_size)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.lock = RLock()
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._get(key) is not None
+
+    def __getitem__(self, key):
+        with self.lock:
+            item = self._get(key)
+            if item is None:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            self.data.move_to_end(key)
+            return item[0]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time())
+            self.data.move_to_end(key)
+            while self.max_size is not None and len(self.data) > self.max_size:
+                self._evict(next(iter(self.data)))
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.data[key]
+
+    def _get(self, key):
+        try:
+            item = self.data[key]
+        except KeyError:
+            return None
+        if self.ttl is not None and time() - item[1] >= self.ttl:
+            self._evict(key)
+            return None
+        return item
+
+    def _evict(self, key):
+        value, _ = self.data.pop(key)
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        with self.lock:
+            try:
+                return self.data.pop(key)[0]
+            except KeyError:
+                return default
+
+    def keys(self):
+        with self.lock:
+            return list(self.data.keys())
+
+    def values(self):
+        with self.lock:
+            return [value for value, _ in self.data.values()]
+
+    def expire(self):
+        if self.ttl is None:
+            return
+        with self.lock:
+            for key in list(self.data.keys()):
+                self._get(key)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
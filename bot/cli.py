@@ -29,6 +29,70 @@ def create_arg_parser():
         choices=('critical', 'error', 'warning', 'info', 'debug'),
         help='log level (default: %(default)s)'
     )
+    parser.add_argument(
+        '-b', '--batch-size',
+        type=int, default=1,
+        help='max updates logged in one database transaction'
+             ' (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--batch-latency',
+        type=float, default=0.05,
+        help='max time to wait for a full batch in seconds'
+             ' (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--log-buffer',
+        type=int, default=0,
+        help='max updates waiting to be logged,'
+             ' 0 to log synchronously (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--log-overflow',
+        default='block',
+        choices=Bot.LOG_OVERFLOW,
+        help='what to do with updates when log buffer is full'
+             ' (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--context-cache-size',
+        type=int, default=64,
+        help='max open generator contexts (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--context-cache-ttl',
+        type=float, default=None,
+        help='close generator contexts unused for this many seconds'
+             ' (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--learn-workers',
+        type=int, default=0,
+        help='generator learner processes,'
+             ' 0 to learn in the bot process (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--script-workers',
+        type=int, default=2,
+        help='idle worker processes kept per script,'
+             ' 0 to start a process per request (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--filter-workers',
+        type=int, default=None,
+        help='image filter processes, 0 to use the filter script'
+             ' (default: number of CPUs)'
+    )
+    parser.add_argument(
+        '--search-rate',
+        type=float, default=1.0,
+        help='max search requests per second (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--search-burst',
+        type=int, default=2,
+        help='max search requests in a burst (default: %(default)s)'
+    )
     parser.add_argument(
         'token',
         metavar='TOKEN_OR_FILE',
@@ -57,7 +121,18 @@ def main(args=None):
     bot = Bot(
         args.token,
         proxy=args.proxy,
-        root=args.data_dir
+        root=args.data_dir,
+        batch_size=args.batch_size,
+        batch_latency=args.batch_latency,
+        log_buffer=args.log_buffer,
+        log_overflow=args.log_overflow,
+        context_cache_size=args.context_cache_size,
+        context_cache_ttl=args.context_cache_ttl,
+        learn_workers=args.learn_workers,
+        script_workers=args.script_workers,
+        filter_workers=args.filter_workers,
+        search_rate=args.search_rate,
+        search_burst=args.search_burst
     )
 
     try:
@@ -1,5 +1,6 @@
 import re
 import os
+import codecs
 import logging
 import subprocess
 
@@ -20,19 +21,22 @@ from telegram.ext import (
     Filters
 )
 
-from bot.models import User
 from bot.util import (
     trunc,
     command,
     update_handler,
     reply_photo,
     reply_file,
+    get_permission,
     CommandType as C,
     Permission as P
 )
 
 
 class BotCommandBase:
+    TIMEOUT_STATUS = 124
+    TIMEOUT_TEXT = '<timeout>'
+
     def __init__(self, bot):
         self.help = 'commands:\n'
         self.logger = logging.getLogger('bot.commands')
@@ -52,9 +56,45 @@ class BotCommandBase:
                 self.callback_query
             ))
 
+    def _is_timeout(self, ex):
+        return (isinstance(ex, subprocess.TimeoutExpired)
+                or ex.returncode == self.TIMEOUT_STATUS)
+
+    def _stream_script(self, update, name, args, timeout):
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        output = ''
+        shown = None
+        message = None
+        timed_out = False
+        try:
+            for data in self.state.scripts.stream(name, args, timeout):
+                output += decoder.decode(data)
+                end = output.rfind('\n\n')
+                if end < 0:
+                    continue
+                text = trunc(output[:end].strip())
+                if not text or text == shown:
+                    continue
+                if message is None:
+                    message = update.message.reply_text(text, quote=True)
+                else:
+                    try:
+                        message = message.edit_text(text)
+                    except TelegramError as ex:
+                        self.logger.warning('edit script output: %r', ex)
+                shown = text
+        except (subprocess.TimeoutExpired,
+                subprocess.CalledProcessError) as ex:
+            if not self._is_timeout(ex):
+                raise
+            timed_out = True
+        output += decoder.decode(b'', True)
+        return output, message, shown, timed_out
+
     def _run_script(self, update, name, args,
                     download=None, no_output='<no output>',
-                    return_image=False, return_file=None, timeout=None):
+                    return_image=False, return_file=None, timeout=None,
+                    stream=False):
         try:
             update.message.bot.send_chat_action(
                 update.effective_chat.id,
@@ -65,35 +105,87 @@ class BotCommandBase:
             pass
         try:
             tmp = None
+            key = None
             ext = 'jpg' if return_image else return_file
-
-            if ext is not None:
-                tmp = os.path.join(self.state.tmp_dir, '%s_%s.%s' % (
-                    update.effective_chat.id,
-                    update.message.message_id,
-                    ext
-                ))
-                args = [tmp if arg == '{{TMP}}' else arg for arg in args]
+            results = self.state.results
 
             if download is not None:
                 download.wait()
-                args.insert(0, download.value)
+                if isinstance(download.value, str):
+                    key = results.key(
+                        name, download.value,
+                        results.digest(os.path.join(
+                            self.state.root, 'scripts', name
+                        )),
+                        args,
+                        ext=ext
+                    )
 
-            args.insert(0, os.path.join(self.state.root, 'scripts', name))
+            result = None
+            message = None
+            shown = None
+            timed_out = False
+            cached = results.get(key) if key is not None else None
 
-            output = subprocess.check_output(
-                args,
-                stderr=subprocess.STDOUT,
-                timeout=timeout or self.state.process_timeout
-            ).decode('utf-8').strip() or no_output
+            if cached is not None:
+                if ext is not None:
+                    result = cached
+                else:
+                    with open(cached, 'rb') as fp:
+                        output = fp.read().decode('utf-8')
+            else:
+                if ext is not None:
+                    tmp = os.path.join(self.state.tmp_dir, '%s_%s.%s' % (
+                        update.effective_chat.id,
+                        update.message.message_id,
+                        ext
+                    ))
+                    args = [tmp if arg == '{{TMP}}' else arg for arg in args]
 
-            if tmp is not None and os.path.exists(tmp):
+                if download is not None:
+                    args.insert(0, download.value)
+
+                if stream:
+                    output, message, shown, timed_out = self._stream_script(
+                        update, name, args,
+                        timeout or self.state.process_timeout
+                    )
+                else:
+                    try:
+                        output = self.state.scripts.run(
+                            name, args, timeout or self.state.process_timeout
+                        ).decode('utf-8')
+                    except (subprocess.TimeoutExpired,
+                            subprocess.CalledProcessError) as ex:
+                        if not self._is_timeout(ex):
+                            raise
+                        output = (ex.output or b'').decode('utf-8', 'replace')
+                        timed_out = True
+
+                if timed_out:
+                    # partial output is shown but never cached
+                    output = '\n\n'.join(filter(None, (
+                        output.strip(), self.TIMEOUT_TEXT
+                    )))
+                else:
+                    output = output.strip() or no_output
+
+                if tmp is not None and os.path.exists(tmp) and not timed_out:
+                    result = tmp
+                    if key is not None:
+                        result = results.save(key, tmp)
+                elif key is not None and ext is None and not timed_out:
+                    results.save(key, output.encode('utf-8'))
+
+            if result is not None:
                 if return_image:
-                    reply_photo(update, tmp, quote=True)
+                    reply_photo(update, result, quote=True)
                 else:
-                    reply_file(update, tmp, quote=True)
-            else:
+                    reply_file(update, result, quote=True)
+            elif message is None:
                 update.message.reply_text(trunc(output), quote=True)
+            elif trunc(output) != shown:
+                message.edit_text(trunc(output))
         except Exception as ex:
             update.message.reply_text(repr(ex), quote=True)
         finally:
@@ -131,8 +223,7 @@ class BotCommandBase:
         cmd = None
         has_cmd = False
 
-        user = User.from_tg(update.callback_query.from_user)
-        if user.permission <= P.BANNED:
+        if get_permission(update.callback_query.from_user) <= P.BANNED:
             return
 
         if msg.text:
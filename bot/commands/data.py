@@ -7,13 +7,16 @@ from telegram import (
 )
 
 from bot.error import CommandError
-from bot.models import db, get_page, User, UserPhone, StickerSet
+from bot.models import (
+    db, clear_caches, get_page, User, UserPhone, StickerSet
+)
 from bot.util import (
     trunc,
     get_command_args,
     command,
     is_phone_number,
     reply_sticker_set,
+    get_permission,
     CommandType as C,
     Permission as P
 )
@@ -34,6 +37,7 @@ class DataCommandMixin:
             '/q <query> - sql query\n'
             '/qr <query> - sql query (read only)\n'
             '/qp [plot type] <query> - sql query plot (read only)\n'
+            '/stats - show bot stats\n'
         )
 
     def _get_user_id(self, msg, phone):
@@ -74,6 +78,7 @@ class DataCommandMixin:
         cursor.execute(query)
         row_count = cursor.rowcount
         db_.commit()
+        clear_caches()
         rows = cursor.fetchall()
         res = '\n'.join(' '.join(repr(col) for col in row) for row in rows)
         if not res:
@@ -111,6 +116,17 @@ class DataCommandMixin:
             timeout=self.state.query_timeout
         )
 
+    @command(C.REPLY_TEXT, P.ADMIN)
+    def cmd_stats(self, *_):
+        stats = self.state.bot.get_stats()
+        res = '\n\n'.join(
+            '%s:\n%s' % (name, '\n'.join(
+                '    %s: %s' % item for item in sorted(values.items())
+            ))
+            for name, values in stats.items()
+        )
+        return res, True
+
     @command(C.REPLY_TEXT, P.ADMIN)
     def cmd_getuser(self, _, update):
         msg = update.message
@@ -135,7 +151,7 @@ class DataCommandMixin:
         if update.effective_chat.type != update.effective_message.chat.PRIVATE:
             permission = 0
         else:
-            permission = User.from_tg(update.effective_user).permission
+            permission = get_permission(update.effective_user)
 
         users = User.select().order_by(
             desc(User.permission),
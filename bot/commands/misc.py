@@ -81,7 +81,8 @@ class MiscCommandMixin:
         deferred = Promise.defer()
         self.state.bot.download_file(msg, self.state.file_dir, deferred)
         self.state.run_async(self._run_script, update,
-                             'ocr', [args], deferred.promise, 'no text found')
+                             'ocr', [args], deferred.promise, 'no text found',
+                             stream=True)
 
     @command(C.NONE)
     def cmd_makesticker(self, _, update):
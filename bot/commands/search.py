@@ -26,6 +26,7 @@ from bot.util import (
 
 class SearchCommandMixin:
     RE_VIDEO_LINK = re.compile(r'^https?://(www\.)?youtube\.com\/')
+    PREWARM = 3
 
     def __init__(self, bot):
         super().__init__(bot)
@@ -141,6 +142,12 @@ class SearchCommandMixin:
                 )
                 return
 
+            results = self.state.search[query]
+            self.state.media.prewarm(
+                item.image
+                for item in results.items[offset + 1:offset + 1 + self.PREWARM]
+            )
+
             for url in (res.image, res.thumbnail, None):
                 try:
                     self.logger.info('%r %r', query, url)
@@ -152,11 +159,21 @@ class SearchCommandMixin:
                             )
                         )
                     else:
-                        send_image(
-                            bot, chat_id, url,
-                            caption=query,
-                            reply_markup=keyboard
-                        )
+                        path = self.state.media.get(url)
+                        if path is None:
+                            send_image(
+                                bot, chat_id, url,
+                                caption=query,
+                                reply_markup=keyboard
+                            )
+                        else:
+                            with open(path, 'rb') as fp:
+                                send_image(
+                                    bot, chat_id, url,
+                                    caption=query,
+                                    reply_markup=keyboard,
+                                    file_=fp
+                                )
                     return
                 except TelegramError as ex:
                     self.logger.info('image post failed: %r: %r', res, ex)
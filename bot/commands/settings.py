@@ -3,6 +3,7 @@ from pony.orm import delete
 
 from bot.models import Alias, Chat
 from bot.error import CommandError
+from bot.safe_regex import check_regex
 from bot.util import (
     strip_command,
     get_command_args,
@@ -56,7 +57,7 @@ class SettingsCommandMixin:
         expr, repl = match.groups()
         expr = expr.strip()
         repl = repl.strip()
-        re.compile(expr)
+        check_regex(expr, re.I)
         chat = Chat.from_tg(update.message.chat)
         Alias(chat=chat, regexp=expr, replace=repl)
         return 'done'
@@ -231,11 +232,7 @@ class SettingsCommandMixin:
         expr = strip_command(message.text)
         if not expr:
             raise CommandError('usage: /settrigger <regexp>')
-        else:
-            try:
-                re.compile(expr)
-            except re.error as ex:
-                raise CommandError(ex)
+        check_regex(expr, re.I)
         chat = Chat.from_tg(message.chat)
         prev = chat.trigger
         chat.trigger = expr
@@ -0,0 +1,324 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import sqlite3
+from array import array
+from random import randint
+from bisect import bisect_right
+from itertools import chain, repeat
+from collections import deque
+
+from markovchain.storage import Storage
+
+
+MAGIC = b'MKVC'
+VERSION = 1
+NONE = 0xffffffff
+ALIGN = 8
+HEADER = struct.Struct('<4sII')
+
+
+class CompactStorage(Storage):
+    def __init__(self, fname):
+        self.fp = open(fname, 'rb')
+        try:
+            self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.fp.close()
+            raise
+        magic, version, size = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s: invalid compact markov file' % fname)
+        header = json.loads(
+            self.mm[HEADER.size:HEADER.size + size].decode('utf-8')
+        )
+        if header['byteorder'] != sys.byteorder:
+            self.close()
+            raise ValueError('%s: byte order mismatch' % fname)
+        super().__init__(header['settings'])
+        base = _align(HEADER.size + size)
+        self.view = memoryview(self.mm)
+        self.sections = {
+            name: self.view[base + offset:base + offset + size].cast(typecode)
+            for name, (offset, size, typecode) in header['sections'].items()
+        }
+        self.datasets = header['datasets']
+        self.node_base = base + header['sections']['node'][0]
+        self.node_count = len(self.sections['node_offsets']) - 1
+
+    def _string(self, name, i):
+        offsets = self.sections[name + '_offsets']
+        return bytes(
+            self.sections[name][offsets[i]:offsets[i + 1]]
+        ).decode('utf-8')
+
+    def _find_node(self, value):
+        value = value.encode('utf-8')
+        offsets = self.sections['node_offsets']
+        blob = self.sections['node']
+        lo, hi = 0, self.node_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            node = bytes(blob[offsets[mid]:offsets[mid + 1]])
+            if node == value:
+                return mid
+            if node < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def _row(self, dataset, state, backward):
+        prefix = '%d_%s_' % (dataset, 'b' if backward else 'f')
+        index = self.sections[prefix + 'index']
+        return (
+            index[state], index[state + 1],
+            self.sections[prefix + 'nodes'],
+            self.sections[prefix + 'values'],
+            self.sections[prefix + 'weights']
+        )
+
+    def _value(self, value):
+        if value == NONE:
+            return None
+        return self._string('word', value)
+
+    def close(self):
+        sections = getattr(self, 'sections', {})
+        for section in sections.values():
+            section.release()
+        sections.clear()
+        if getattr(self, 'view', None) is not None:
+            self.view.release()
+            self.view = None
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def get_dataset(self, key, create=False):
+        return self.datasets[key]
+
+    def replace_state_separator(self, old_separator, new_separator):
+        raise ValueError('compact markov storage is read-only')
+
+    def add_links(self, links, dataset_prefix=''):
+        raise ValueError('compact markov storage is read-only')
+
+    def get_state(self, state, size):
+        state = deque(chain(repeat('', size), state), maxlen=size)
+        return self._find_node(self.join_state(state))
+
+    def get_states(self, dataset, string):
+        dataset = self.get_dataset(dataset)
+        needle = string.encode('utf-8')
+        offsets = self.sections['node_offsets']
+        index = self.sections['%d_f_index' % dataset]
+        base = self.node_base
+        end = base + offsets[self.node_count]
+        ret = []
+        pos = self.mm.find(needle, base, end)
+        while pos >= 0:
+            pos -= base
+            i = bisect_right(offsets, pos) - 1
+            if (pos + len(needle) <= offsets[i + 1]
+                    and index[i] != index[i + 1]):
+                ret.append(self._string('node', i))
+            pos = self.mm.find(
+                needle, base + max(offsets[i + 1], pos + 1), end
+            )
+        return ret
+
+    def get_links(self, dataset, state, backward=False):
+        if state is None:
+            return []
+        start, end, nodes, values, weights = self._row(
+            dataset, state, backward
+        )
+        ret = []
+        prev = 0
+        for i in range(start, end):
+            node = nodes[i]
+            ret.append((
+                weights[i] - prev,
+                self._value(values[i]),
+                None if node == NONE else node
+            ))
+            prev = weights[i]
+        return ret
+
+    def random_link(self, dataset, state, backward=False):
+        if state is None:
+            return None, None
+        start, end, nodes, values, weights = self._row(
+            dataset, state, backward
+        )
+        if start == end:
+            return None, None
+        x = randint(0, weights[end - 1] - 1)
+        i = bisect_right(weights, x, start, end)
+        node = nodes[i]
+        return self._value(values[i]), None if node == NONE else node
+
+    def follow_link(self, link, state, backward=False):
+        return link[2]
+
+    def do_save(self, fp=None):
+        raise ValueError('compact markov storage is read-only')
+
+    @classmethod
+    def load(cls, fp):
+        return cls(fp)
+
+
+def _align(offset):
+    return offset + (-offset % ALIGN)
+
+def _strings(values):
+    offsets = array('Q', [0])
+    blob = bytearray()
+    for value in values:
+        blob.extend(value)
+        offsets.append(len(blob))
+    return blob, offsets
+
+def _csr(rows, count):
+    rows.sort(key=lambda row: row[0])
+    index = array('Q', [0] * (count + 1))
+    nodes = array('I')
+    values = array('I')
+    weights = array('Q')
+    total = 0
+    prev = None
+    for row, node, value, weight in rows:
+        if row != prev:
+            total = 0
+            prev = row
+        total += weight
+        index[row + 1] += 1
+        nodes.append(node)
+        values.append(value)
+        weights.append(total)
+    for i in range(count):
+        index[i + 1] += index[i]
+    return index, nodes, values, weights
+
+def export(src, dst, progress=None):
+    db = sqlite3.connect(src)
+    try:
+        cursor = db.cursor()
+        cursor.execute('SELECT settings FROM main')
+        settings = json.loads(cursor.fetchone()[0])
+
+        cursor.execute('SELECT id, value FROM nodes')
+        nodes = sorted(
+            (value.encode('utf-8'), id_) for id_, value in cursor.fetchall()
+        )
+        node_ids = {id_: i for i, (_, id_) in enumerate(nodes)}
+        node_blob, node_offsets = _strings(value for value, _ in nodes)
+        del nodes
+
+        cursor.execute(
+            'SELECT value FROM links UNION SELECT bvalue FROM links'
+        )
+        words = sorted(
+            value.encode('utf-8')
+            for value, in cursor.fetchall()
+            if value is not None
+        )
+        word_ids = {value.decode('utf-8'): i for i, value in enumerate(words)}
+        word_ids[None] = NONE
+        word_blob, word_offsets = _strings(words)
+        del words
+
+        sections = [
+            ('node', node_blob),
+            ('node_offsets', node_offsets),
+            ('word', word_blob),
+            ('word_offsets', word_offsets)
+        ]
+        cursor.execute('SELECT id, key FROM datasets')
+        datasets = {}
+        for dataset, key in cursor.fetchall():
+            datasets[key] = dataset
+            cursor.execute(
+                'SELECT source, target, value, bvalue, count'
+                ' FROM links WHERE dataset=?',
+                (dataset,)
+            )
+            links = cursor.fetchall()
+            forward = [
+                (node_ids[source],
+                 NONE if target is None else node_ids[target],
+                 word_ids[value],
+                 count)
+                for source, target, value, _, count in links
+            ]
+            backward = [
+                (node_ids[target], node_ids[source], word_ids[bvalue], count)
+                for source, target, _, bvalue, count in links
+                if target is not None
+            ]
+            del links
+            for direction, rows in (('f', forward), ('b', backward)):
+                arrays = _csr(rows, len(node_offsets) - 1)
+                for name, data in zip(
+                        ('index', 'nodes', 'values', 'weights'), arrays):
+                    sections.append(
+                        ('%d_%s_%s' % (dataset, direction, name), data)
+                    )
+            if progress is not None:
+                progress(key, len(forward))
+    finally:
+        db.close()
+
+    offset = 0
+    table = {}
+    for name, data in sections:
+        typecode = data.typecode if isinstance(data, array) else 'B'
+        size = len(data) * (data.itemsize if isinstance(data, array) else 1)
+        table[name] = [offset, size, typecode]
+        offset = _align(offset + size)
+    header = json.dumps({
+        'byteorder': sys.byteorder,
+        'settings': settings,
+        'datasets': datasets,
+        'sections': table
+    }).encode('utf-8')
+    start = _align(HEADER.size + len(header))
+
+    tmp = dst + '.tmp'
+    with open(tmp, 'wb') as fp:
+        fp.write(HEADER.pack(MAGIC, VERSION, len(header)))
+        fp.write(header)
+        for name, data in sections:
+            fp.seek(start + table[name][0])
+            fp.write(data)
+    os.replace(tmp, dst)
+
+
+def main(argv):
+    if len(argv) != 2:
+        print('usage: python -m bot.compact_markov <context_dir>', file=sys.stderr)
+        return 1
+    src = os.path.join(argv[1], 'markov.db')
+    dst = os.path.join(argv[1], 'markov.bin')
+    if not os.path.isfile(src):
+        print('not found: %s' % src, file=sys.stderr)
+        return 1
+    export(
+        src, dst,
+        lambda key, count: print('dataset %s: %d links' % (key, count))
+    )
+    print('%s: %d -> %d bytes' % (
+        dst, os.path.getsize(src), os.path.getsize(dst)
+    ))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
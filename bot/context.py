@@ -1,10 +1,18 @@
 import os
+import re
 import json
+import sqlite3
+from time import time
+from threading import RLock
+from contextlib import contextmanager
+from collections import deque
 
 from markovchain.text import MarkovText, ReplyMode
 from markovchain.storage import SqliteStorage
 
-from .error import CommandError
+from .bloom import DuplicateFilter
+from .error import CommandError, ContextClosed
+from .compact_markov import CompactStorage
 from .namespace import Namespace
 
 
@@ -12,43 +20,244 @@ class Context:
     PATH_SETTINGS = [
         'filter'
     ]
+    LEARN_BUFFER_DEFAULT = 1
+    LEARN_INTERVAL_DEFAULT = 60
+    POOL_SIZE_DEFAULT = 0
+    DEDUP_WINDOW_DEFAULT = 0
+    POOL_TTL = 600
+    RE_WORD = re.compile(r'\w{3,}')
 
-    def __init__(self, root, defaults, is_private=False):
+    def __init__(self, root, defaults, is_private=False, learner=None):
         self.root = root
         self.name = os.path.basename(self.root)
         self.is_writable = not root.endswith('_ro')
         self.is_private = is_private
-        self.markov = MarkovText.from_file(
-            os.path.join(self.root, 'markov.db'),
-            storage=SqliteStorage
-        )
+        self.learner = learner
+        self.lock = RLock()
+        self.markov = None
+        self.markov_ino = None
+        self.closed = False
+        self.learn_pending = []
+        self.learn_start = None
+        self.pool = {}
+        self.pool_used = {}
+        self.pool_stats = {
+            'hits': 0,
+            'misses': 0,
+            'reply_hits': 0,
+            'reply_misses': 0,
+            'generated': 0,
+            'invalidated': 0
+        }
+        self.open()
         self.settings = self.load_settings(
             os.path.join(self.root, 'settings.json'),
             self.root,
             defaults
         )
-        self.markov.save()
+        self.learn_buffer = self.get_setting(
+            'learn_buffer', self.LEARN_BUFFER_DEFAULT
+        )
+        self.learn_interval = self.get_setting(
+            'learn_interval', self.LEARN_INTERVAL_DEFAULT
+        )
+        self.pool_size = self.get_setting(
+            'pool_size', self.POOL_SIZE_DEFAULT
+        )
+        dedup_window = self.get_setting(
+            'dedup_window', self.DEDUP_WINDOW_DEFAULT
+        )
+        self.dedup = DuplicateFilter(dedup_window) if dedup_window else None
 
     def __str__(self):
         return self.name
 
+    def open(self):
+        with self.lock:
+            if self.closed:
+                raise ContextClosed('context closed: %s' % self.name)
+            if self.markov is None and not self.is_writable:
+                fname = os.path.join(self.root, 'markov.bin')
+                if os.path.isfile(fname):
+                    self.markov = MarkovText.from_storage(
+                        CompactStorage.load(fname)
+                    )
+            if self.markov is None:
+                fname = os.path.join(self.root, 'markov.db')
+                db = sqlite3.connect(
+                    fname,
+                    isolation_level='IMMEDIATE',
+                    check_same_thread=False
+                )
+                if self.learner is not None:
+                    db.execute('PRAGMA journal_mode=WAL')
+                self.markov = MarkovText.from_storage(SqliteStorage.load(db))
+                self.markov.save()
+                self.markov_ino = os.stat(fname).st_ino
+            return self.markov
+
+    def reopen_if_replaced(self):
+        with self.lock:
+            if self.markov is None or self.markov_ino is None:
+                return
+            try:
+                ino = os.stat(os.path.join(self.root, 'markov.db')).st_ino
+            except OSError:
+                return
+            if ino != self.markov_ino:
+                self.markov.close()
+                self.markov = None
+                self.markov_ino = None
+                for pool in self.pool.values():
+                    self.pool_stats['invalidated'] += len(pool)
+                    pool.clear()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.flush()
+            self.closed = True
+            if self.markov is not None:
+                self.markov.close()
+                self.markov = None
+                self.markov_ino = None
+
+    @contextmanager
+    def snapshot(self):
+        with self.lock:
+            self.reopen_if_replaced()
+            markov = self.open()
+            if (self.learner is None
+                    or isinstance(markov.storage, CompactStorage)):
+                yield markov
+                return
+            storage = markov.storage
+            db = storage.db
+            db.execute('BEGIN DEFERRED')
+            try:
+                storage.cursor.execute('SELECT key, id FROM datasets')
+                storage.datasets = dict(storage.cursor.fetchall())
+                yield markov
+            finally:
+                db.rollback()
+
+    def get_setting(self, name, default=None):
+        try:
+            return self.settings[name]
+        except KeyError:
+            return default
+
     def get_orders(self):
-        return self.markov.parser.state_sizes
+        with self.lock:
+            return self.open().parser.state_sizes
+
+    def _pool_get(self, key, words=None):
+        self.pool_used[key] = time()
+        pool = self.pool.get(key)
+        if not pool:
+            return None
+        if words is None:
+            return pool.popleft()
+        for i, candidate in enumerate(pool):
+            if words.intersection(self.RE_WORD.findall(candidate.lower())):
+                del pool[i]
+                return candidate
+        return None
+
+    def refill(self, limit=None):
+        if not self.pool_size:
+            return 0
+        count = 0
+        now = time()
+        with self.lock:
+            keys = list(self.pool_used.items())
+        for key, used in keys:
+            if now - used >= self.POOL_TTL:
+                with self.lock:
+                    self.pool_used.pop(key, None)
+                    self.pool.pop(key, None)
+                continue
+            while limit is None or count < limit:
+                with self.lock:
+                    pool = self.pool.setdefault(key, deque())
+                    if len(pool) >= self.pool_size:
+                        break
+                    try:
+                        with self.snapshot() as markov:
+                            text = markov(
+                                state_size=key[0], max_length=key[1]
+                            )
+                    except KeyError:
+                        break
+                    count += 1
+                    self.pool_stats['generated'] += 1
+                    if not text:
+                        break
+                    pool.append(text)
+        return count
 
     def random_text(self, order, max_length):
-        return self.markov(state_size=order, max_length=max_length)
+        with self.lock:
+            if self.pool_size:
+                ret = self._pool_get((order, max_length))
+                if ret is not None:
+                    self.pool_stats['hits'] += 1
+                    return ret
+                self.pool_stats['misses'] += 1
+            with self.snapshot() as markov:
+                return markov(state_size=order, max_length=max_length)
 
     def reply_text(self, text, order, max_length):
-        return self.markov(
-            state_size=order,
-            max_length=max_length,
-            reply_to=text,
-            reply_mode=ReplyMode.REPLY
-        )
+        with self.lock:
+            if self.pool_size:
+                words = set(self.RE_WORD.findall(text.lower()))
+                ret = self._pool_get((order, max_length), words)
+                if ret is not None:
+                    self.pool_stats['reply_hits'] += 1
+                    return ret
+                self.pool_stats['reply_misses'] += 1
+        with self.snapshot() as markov:
+            return markov(
+                state_size=order,
+                max_length=max_length,
+                reply_to=text,
+                reply_mode=ReplyMode.REPLY
+            )
+
+    def is_duplicate(self, text):
+        return self.dedup is not None and self.dedup.check(text)
 
     def learn_text(self, text):
-        self.markov.data(text)
-        self.markov.save()
+        with self.lock:
+            if self.closed:
+                raise ContextClosed('context closed: %s' % self.name)
+            if not self.learn_pending:
+                self.learn_start = time()
+            self.learn_pending.append(text)
+            self.flush(False)
+
+    def flush(self, force=True):
+        with self.lock:
+            if not self.learn_pending:
+                return
+            if not (force
+                    or len(self.learn_pending) >= self.learn_buffer
+                    or time() - self.learn_start >= self.learn_interval):
+                return
+            if self.learner is not None:
+                self.learner.learn(self.root, self.learn_pending)
+            else:
+                self.reopen_if_replaced()
+                markov = self.open()
+                for text in self.learn_pending:
+                    markov.data(text)
+                markov.save()
+            self.learn_pending = []
+            self.learn_start = None
+            for pool in self.pool.values():
+                self.pool_stats['invalidated'] += len(pool)
+                pool.clear()
 
     def random_sticker(self):
         raise CommandError('random_sticker: not implemented')
@@ -57,7 +266,7 @@ class Context:
         raise CommandError('reply_sticker: not implemented')
 
     @classmethod
-    def create(cls, root, settings):
+    def create(cls, root, settings, **kwargs):
         os.mkdir(root)
         with open(settings, 'rt') as fp:
             settings = json.load(fp)
@@ -70,7 +279,7 @@ class Context:
         storage.db.close()
         storage.db = None
         storage.cursor = None
-        return cls(root, settings)
+        return cls(root, settings, **kwargs)
 
     @classmethod
     def load_settings(cls, fname, root, parent):
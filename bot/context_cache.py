@@ -1,18 +1,38 @@
 import os
 import shutil
+import logging
+from time import time
+from threading import RLock
 
+from .cache import LRUCache
 from .context import Context
 
 
 class ContextCache:
-    def __init__(self, root):
+    MAX_SIZE_DEFAULT = 64
+    FLUSH_INTERVAL = 10
+    POOL_INTERVAL = 5
+    POOL_REFILL_LIMIT = 32
+
+    def __init__(self, root, max_size=MAX_SIZE_DEFAULT, ttl=None,
+                 learner=None):
+        self.logger = logging.getLogger(__name__)
+        self.learner = learner
+        self.lock = RLock()
         self.root = os.path.join(root, 'public')
         self.root_private = os.path.join(root, 'private')
         self.root_settings = os.path.join(root, '..', 'settings')
         os.makedirs(self.root, exist_ok=True)
         os.makedirs(self.root_private, exist_ok=True)
         os.makedirs(self.root_settings, exist_ok=True)
-        self.context = {}
+        self.context = LRUCache(max_size, ttl, self._on_evict)
+        self.private = set(
+            fname
+            for fname in os.listdir(self.root_private)
+            if os.path.isdir(os.path.join(self.root_private, fname))
+        )
+        self.loads = 0
+        self.load_time = 0.0
         self.defaults = Context.load_settings(
             os.path.join(self.root_settings, 'default.json'),
             self.root_settings,
@@ -22,6 +42,67 @@ class ContextCache:
     def __contains__(self, name):
         return name in self.context
 
+    def _on_evict(self, name, ctx):
+        self.logger.info('evict context %s', name)
+        try:
+            ctx.close()
+        except Exception as ex:
+            self.logger.error('close context %s: %r', name, ex)
+
+    def expire(self):
+        self.context.expire()
+
+    def flush(self, force=True):
+        for ctx in self.context.values():
+            try:
+                ctx.flush(force)
+            except Exception as ex:
+                self.logger.error('flush context %s: %r', ctx, ex)
+
+    def refill(self, limit=POOL_REFILL_LIMIT):
+        count = 0
+        for ctx in self.context.values():
+            if count >= limit:
+                break
+            try:
+                count += ctx.refill(limit - count)
+            except Exception as ex:
+                self.logger.error('refill context %s: %r', ctx, ex)
+        return count
+
+    def close(self):
+        for ctx in self.context.values():
+            ctx.close()
+        self.context.clear()
+
+    def stats(self):
+        ret = self.context.stats()
+        ret['learn_pending'] = sum(
+            len(ctx.learn_pending) for ctx in self.context.values()
+        )
+        contexts = self.context.values()
+        pool = {
+            key: sum(ctx.pool_stats[key] for ctx in contexts)
+            for key in ('hits', 'misses', 'reply_hits', 'reply_misses',
+                        'generated', 'invalidated')
+        }
+        pool['size'] = sum(
+            len(texts) for ctx in contexts for texts in ctx.pool.values()
+        )
+        for key, value in pool.items():
+            ret['pool_' + key] = value
+        for key in ('checked', 'suppressed'):
+            ret['dedup_' + key] = sum(
+                ctx.dedup.stats()[key]
+                for ctx in contexts
+                if ctx.dedup is not None
+            )
+        ret['loads'] = self.loads
+        ret['load_time_avg'] = (
+            '%.3f' % (self.load_time / self.loads) if self.loads else None
+        )
+        return ret
+
     def load(self, name):
         raise NotImplementedError('context load')
 
@@ -35,26 +116,30 @@ class ContextCache:
         raise FileNotFoundError('context not found: "%s"' % name)
 
     def create_private(self, name):
-        if name in self:
-            raise ValueError('context exists: %s' % name)
-        ret = Context.create(
-            os.path.join(self.root_private, name),
-            os.path.join(self.root_settings, 'markov.json')
-        )
-        self.context[name] = ret
-        return ret
+        with self.lock:
+            if name in self:
+                raise ValueError('context exists: %s' % name)
+            ret = Context.create(
+                os.path.join(self.root_private, name),
+                os.path.join(self.root_settings, 'markov.json'),
+                learner=self.learner
+            )
+            self.private.add(name)
+            self.context[name] = ret
+            return ret
 
     def has_private(self, chat):
-        name = str(chat.id)
-        return os.path.isdir(os.path.join(self.root_private, name))
+        return str(chat.id) in self.private
 
     def delete_private(self, chat):
         name = str(chat.id)
+        ctx = self.context.pop(name)
+        if ctx is not None:
+            ctx.close()
+        if self.learner is not None:
+            self.learner.forget(os.path.join(self.root_private, name))
+        self.private.discard(name)
         shutil.rmtree(os.path.join(self.root_private, name))
-        try:
-            del self.context[name]
-        except KeyError:
-            pass
 
     def get(self, name):
         if name is None:
@@ -62,17 +147,27 @@ class ContextCache:
         try:
             return self.context[name]
         except KeyError:
+            pass
+        with self.lock:
+            # another thread may have loaded it while we were waiting
+            ctx = self.context.get(name)
+            if ctx is not None:
+                return ctx
             path, private = self.get_path(name)
-            ctx = Context(path, self.defaults, private)
+            start = time()
+            ctx = Context(path, self.defaults, private, self.learner)
+            self.loads += 1
+            self.load_time += time() - start
             self.context[name] = ctx
             return ctx
 
     def get_private(self, chat):
         name = str(chat.id)
-        try:
-            return self.get(name)
-        except FileNotFoundError:
-            return self.create_private(name)
+        with self.lock:
+            try:
+                return self.get(name)
+            except FileNotFoundError:
+                return self.create_private(name)
 
     def list(self, chat_id=None):
         ret = [
@@ -82,8 +177,7 @@ class ContextCache:
         ]
         if chat_id is not None:
             chat_id = str(chat_id)
-            private = os.path.join(self.root_private, chat_id)
-            if os.path.isdir(private):
+            if chat_id in self.private:
                 ret.append(chat_id)
             else:
                 ret.append('new private context')
@@ -13,5 +13,14 @@ class BotError(Exception):
 class CommandError(BotError):
     pass
 
+class ContextClosed(BotError):
+    pass
+
 class SearchError(BotError):
     pass
+
+class RegexError(BotError):
+    pass
+
+class RegexTimeout(RegexError):
+    pass
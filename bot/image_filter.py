@@ -0,0 +1,87 @@
+import io
+import os
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image
+    from markovchain.image import MarkovImage
+    from markovchain.storage import JsonStorage
+except ImportError:
+    Image = None
+
+
+JPEG_QUALITY = 90
+
+
+def parse_size(size):
+    width, _, height = str(size).lower().partition('x')
+    width = int(width)
+    height = int(height) if height else width
+    if width <= 0 or height <= 0:
+        raise ValueError('invalid image size: %r' % size)
+    return width, height
+
+def thumbnail(img, size):
+    width, height = size
+    scale = min(width / img.width, height / img.height)
+    return img.resize(
+        (max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+        Image.BICUBIC
+    )
+
+def filter_image(data, size, settings):
+    img = Image.open(io.BytesIO(data))
+    img = thumbnail(img.convert('RGB'), parse_size(size))
+    markov = MarkovImage.from_storage(JsonStorage(settings=settings))
+    markov.data(img, False)
+    scale = markov.scanner.min_size
+    img = markov(max(1, img.width // scale), max(1, img.height // scale))
+    ret = io.BytesIO()
+    img.convert('RGB').save(ret, 'jpeg', quality=JPEG_QUALITY)
+    return ret.getvalue()
+
+def _filter_file(fname, size, settings_path):
+    with open(fname, 'rb') as fp:
+        data = fp.read()
+    with open(settings_path) as fp:
+        settings = json.load(fp)
+    return filter_image(data, size, settings)
+
+
+class ImageFilter:
+    def __init__(self, workers=None):
+        if Image is None:
+            raise RuntimeError('image filter requires pillow')
+        self.workers = workers or os.cpu_count()
+        self.executor = ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        self.jobs = 0
+        self.errors = 0
+
+    @staticmethod
+    def is_available():
+        return Image is not None
+
+    def __call__(self, fname, size, settings_path, timeout=None):
+        self.jobs += 1
+        future = self.executor.submit(_filter_file, fname, size, settings_path)
+        try:
+            return future.result(timeout)
+        except Exception:
+            self.errors += 1
+            future.cancel()
+            raise
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'jobs': self.jobs,
+            'errors': self.errors
+        }
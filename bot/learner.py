@@ -0,0 +1,118 @@
+import os
+import zlib
+import sqlite3
+import logging
+import multiprocessing
+from collections import OrderedDict
+
+from markovchain.text import MarkovText
+from markovchain.storage import SqliteStorage
+
+
+WORKER_MAX_OPEN = 16
+WORKER_JOIN_TIMEOUT = 60
+
+
+def open_markov(root):
+    db = sqlite3.connect(
+        os.path.join(root, 'markov.db'),
+        isolation_level='IMMEDIATE'
+    )
+    db.execute('PRAGMA journal_mode=WAL')
+    return MarkovText.from_storage(SqliteStorage.load(db))
+
+def get_model(markov, root):
+    ino = os.stat(os.path.join(root, 'markov.db')).st_ino
+    try:
+        model, model_ino = markov[root]
+        markov.move_to_end(root)
+        if model_ino == ino:
+            return model
+        del markov[root]
+        model.close()
+    except KeyError:
+        pass
+    model = open_markov(root)
+    markov[root] = model, ino
+    while len(markov) > WORKER_MAX_OPEN:
+        markov.popitem(last=False)[1][0].close()
+    return model
+
+def _worker(queue):
+    logger = logging.getLogger(__name__)
+    markov = OrderedDict()
+    try:
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            cmd, root, texts = item
+            try:
+                if cmd == 'close':
+                    try:
+                        markov.pop(root)[0].close()
+                    except KeyError:
+                        pass
+                    continue
+                model = get_model(markov, root)
+                for text in texts:
+                    model.data(text)
+                model.save()
+            except Exception as ex:
+                logger.error('learner: %s: %r', root, ex)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for model, _ in markov.values():
+            model.close()
+
+
+class Learner:
+    def __init__(self, workers=1):
+        if workers < 1:
+            raise ValueError('invalid learner worker count: %r' % workers)
+        self.logger = logging.getLogger(__name__)
+        context = multiprocessing.get_context('spawn')
+        self.queues = [context.Queue() for _ in range(workers)]
+        self.processes = [
+            context.Process(target=_worker, args=(queue,), daemon=True)
+            for queue in self.queues
+        ]
+        for process in self.processes:
+            process.start()
+        self.batches = 0
+        self.texts = 0
+        self.logger.info('learner: %d workers', workers)
+
+    def _queue(self, root):
+        return self.queues[zlib.crc32(root.encode('utf-8')) % len(self.queues)]
+
+    def learn(self, root, texts):
+        self._queue(root).put(('learn', root, list(texts)))
+        self.batches += 1
+        self.texts += len(texts)
+
+    def forget(self, root):
+        self._queue(root).put(('close', root, None))
+
+    def close(self):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(WORKER_JOIN_TIMEOUT)
+            if process.is_alive():
+                self.logger.error('learner: worker %s timeout', process.pid)
+                process.kill()
+        self.processes = []
+
+    def stats(self):
+        try:
+            pending = sum(queue.qsize() for queue in self.queues)
+        except NotImplementedError:
+            pending = None
+        return {
+            'workers': len(self.processes),
+            'batches': self.batches,
+            'texts': self.texts,
+            'pending': pending
+        }
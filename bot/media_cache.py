@@ -0,0 +1,168 @@
+import os
+import sqlite3
+import hashlib
+import logging
+from time import time
+from threading import Lock, get_ident
+from concurrent.futures import ThreadPoolExecutor
+
+from .search import request, get_referer
+
+
+class MediaCache:
+    MAX_SIZE_DEFAULT = 256 * 1024 * 1024
+    MAX_FILE_SIZE = 10 * 1024 * 1024
+    WORKERS_DEFAULT = 4
+    TIMEOUT = 10
+
+    def __init__(self, root, http, headers=None,
+                 max_size=MAX_SIZE_DEFAULT, workers=WORKERS_DEFAULT):
+        self.logger = logging.getLogger(__name__)
+        self.root = root
+        self.http = http
+        self.headers = headers if headers is not None else {}
+        self.max_size = max_size
+        self.lock = Lock()
+        self.pending = set()
+        self.executor = ThreadPoolExecutor(workers)
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self.errors = 0
+        self.evictions = 0
+        os.makedirs(self.root, exist_ok=True)
+        self.db = sqlite3.connect(
+            os.path.join(self.root, 'index.db'),
+            check_same_thread=False
+        )
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS media (
+                url TEXT NOT NULL PRIMARY KEY,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                used REAL NOT NULL
+            )
+        ''')
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS media_digest ON media (digest)'
+        )
+        self.db.commit()
+
+    def _path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def get(self, url):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT digest FROM media WHERE url=?', (url,)
+            ).fetchone()
+            if row is not None:
+                path = self._path(row[0])
+                if os.path.exists(path):
+                    self.db.execute(
+                        'UPDATE media SET used=? WHERE digest=?',
+                        (time(), row[0])
+                    )
+                    self.db.commit()
+                    self.hits += 1
+                    return path
+                self.db.execute('DELETE FROM media WHERE url=?', (url,))
+                self.db.commit()
+            self.misses += 1
+            return None
+
+    def fetch(self, url):
+        headers = dict(self.headers)
+        headers['Referer'] = get_referer(url)
+        data = request(
+            self.http, 'GET', url,
+            headers=headers, timeout=self.TIMEOUT
+        )
+        if len(data) > self.MAX_FILE_SIZE:
+            raise ValueError('%s: file is too large: %d' % (url, len(data)))
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = '%s.%d.%d.tmp' % (path, os.getpid(), get_ident())
+            with open(tmp, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp, path)
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO media (url, digest, size, used)'
+                ' VALUES (?, ?, ?, ?)',
+                (url, digest, len(data), time())
+            )
+            self.db.commit()
+            self.downloads += 1
+            self._evict()
+        return path
+
+    def _evict(self):
+        size = self.db.execute(
+            'SELECT sum(size) FROM'
+            ' (SELECT max(size) AS size FROM media GROUP BY digest)'
+        ).fetchone()[0] or 0
+        if size <= self.max_size:
+            return
+        rows = self.db.execute(
+            'SELECT digest, max(size) FROM media'
+            ' GROUP BY digest ORDER BY max(used)'
+        ).fetchall()
+        for digest, digest_size in rows:
+            if size <= self.max_size:
+                break
+            self.db.execute('DELETE FROM media WHERE digest=?', (digest,))
+            try:
+                os.remove(self._path(digest))
+            except OSError as ex:
+                self.logger.warning('evict %s: %r', digest, ex)
+            size -= digest_size
+            self.evictions += 1
+        self.db.commit()
+
+    def _prewarm(self, url):
+        try:
+            self.fetch(url)
+        except Exception as ex:
+            self.logger.info('prewarm %s: %r', url, ex)
+            self.errors += 1
+        finally:
+            with self.lock:
+                self.pending.discard(url)
+
+    def prewarm(self, urls):
+        for url in urls:
+            with self.lock:
+                if url in self.pending:
+                    continue
+                if self.db.execute(
+                        'SELECT 1 FROM media WHERE url=?', (url,)
+                ).fetchone() is not None:
+                    continue
+                self.pending.add(url)
+            self.executor.submit(self._prewarm, url)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        with self.lock:
+            self.db.close()
+
+    def stats(self):
+        with self.lock:
+            count, size = self.db.execute(
+                'SELECT count(*), sum(size) FROM'
+                ' (SELECT max(size) AS size FROM media GROUP BY digest)'
+            ).fetchone()
+            return {
+                'files': count,
+                'size': size or 0,
+                'max_size': self.max_size,
+                'pending': len(self.pending),
+                'hits': self.hits,
+                'misses': self.misses,
+                'downloads': self.downloads,
+                'errors': self.errors,
+                'evictions': self.evictions
+            }
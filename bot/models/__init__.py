@@ -1,10 +1,14 @@
 import os
 from pony.orm import flush
 
-from .db import sqlite3, db, get_page, get_or_create, update_or_create
+from .db import (
+    sqlite3, db, entity_cache, get_page, get_or_create, update_or_create,
+    get_cached, is_cached, is_fresh
+)
 from .tg import (
     User, Chat, Message, UserPhone, Alias,
-    StickerSet, Sticker, SearchQuery, SearchLog
+    StickerSet, Sticker, SearchQuery, SearchLog,
+    permission_cache, alias_cache
 )
 from .game import (
     PokemonType, PokemonTypeEffectiveness, PokemonExpType,
@@ -20,5 +24,10 @@ def connect(path):
     db.generate_mapping(create_tables=True)
     return db
 
+def clear_caches():
+    entity_cache.clear()
+    permission_cache.clear()
+    alias_cache.clear()
+
 def get_db_path(root):
     return os.path.join(root, 'bot.db')
@@ -3,6 +3,8 @@ import time
 import pony.orm
 import pony.orm.dbproviders.sqlite
 
+from bot.cache import LRUCache
+
 try:
     import pysqlite3 as sqlite3
 except ImportError:
@@ -14,8 +16,11 @@ def patch_sqlite_provider(module):
     module.SQLiteTranslator.sqlite_version = sqlite3.sqlite_version_info
     module.SQLiteProvider.server_version = sqlite3.sqlite_version_info
 
+ENTITY_CACHE_SIZE = 4096
+
 patch_sqlite_provider(pony.orm.dbproviders.sqlite)
 db = pony.orm.Database()
+entity_cache = LRUCache(ENTITY_CACHE_SIZE)
 
 @db.on_connect(provider='sqlite')
 def sqlite_config(_, connection):
@@ -29,10 +34,39 @@ def get_page(query, page, page_size):
     res = query[(page - 1) * page_size:page * page_size]
     return res, pages
 
+def cache_entity(obj):
+    try:
+        attrs = obj.CACHED_ATTRS
+    except AttributeError:
+        return
+    entity_cache[(obj.__class__.__name__, obj.id)] = {
+        attr: getattr(obj, attr) for attr in attrs
+    }
+
+def uncache_entity(obj):
+    entity_cache.pop((obj.__class__.__name__, obj.id))
+
+def get_cached(cls, id_, **kwargs):
+    ret = entity_cache.get((cls.__name__, id_))
+    if ret is None:
+        get_or_create(cls, id_, **kwargs)
+        ret = entity_cache[(cls.__name__, id_)]
+    return ret
+
+def is_cached(cls, id_):
+    return (cls.__name__, id_) in entity_cache
+
+def is_fresh(cls, id_, interval):
+    data = entity_cache.get((cls.__name__, id_))
+    if data is None:
+        return False
+    return interval <= 0 or int(time.time()) - data['last_update'] < interval
+
 def get_or_create(cls, id_, **kwargs):
     ret = cls.get(id=id_)
     if ret is None:
         ret = cls(id=id_, **kwargs)
+    cache_entity(ret)
     return ret
 
 def update_or_create(cls, id_, interval=None, **kwargs):
@@ -42,12 +76,16 @@ def update_or_create(cls, id_, interval=None, **kwargs):
         kwargs['last_update'] = current_time
 
     if ret is None:
-        return cls(id=id_, **kwargs)
+        ret = cls(id=id_, **kwargs)
+        cache_entity(ret)
+        return ret
 
     if interval is not None:
         if interval <= 0 or current_time - ret.last_update < interval:
+            cache_entity(ret)
             return ret
 
     for key, val in kwargs.items():
         setattr(ret, key, val)
+    cache_entity(ret)
     return ret
@@ -1,9 +1,25 @@
 from pony.orm import PrimaryKey, Required, Optional, Set
 
-from .db import db, get_or_create
+from bot.cache import LRUCache
+
+from .db import (
+    db, get_or_create, get_cached, cache_entity, uncache_entity
+)
+
+
+PERMISSION_CACHE_SIZE = 4096
+ALIAS_CACHE_SIZE = 1024
+
+permission_cache = LRUCache(PERMISSION_CACHE_SIZE)
+alias_cache = LRUCache(ALIAS_CACHE_SIZE)
 
 
 class User(db.Entity):
+    CACHED_ATTRS = (
+        'id', 'first_name', 'last_name', 'username',
+        'permission', 'last_update'
+    )
+
     id = PrimaryKey(int, size=64)
     first_name = Optional(str, nullable=True)
     last_name = Optional(str, nullable=True)
@@ -43,6 +59,26 @@ class User(db.Entity):
             username=user.username
         )
 
+    @classmethod
+    def from_tg_cached(cls, user):
+        return get_cached(
+            cls, user.id,
+            first_name=user.first_name, last_name=user.last_name,
+            username=user.username
+        )
+
+    def after_insert(self):
+        cache_entity(self)
+        permission_cache[self.id] = self.permission
+
+    def after_update(self):
+        cache_entity(self)
+        permission_cache[self.id] = self.permission
+
+    def before_delete(self):
+        uncache_entity(self)
+        permission_cache.pop(self.id)
+
     def heal(self):
         for p in self.pokemon:
             p.heal()
@@ -77,6 +113,11 @@ class User(db.Entity):
 
 
 class Chat(db.Entity):
+    CACHED_ATTRS = (
+        'id', 'title', 'type', 'last_update', 'context',
+        'order', 'learn', 'reply_max_length', 'trigger'
+    )
+
     id = PrimaryKey(int, size=64)
     title = Optional(str, nullable=True)
     invite_link = Optional(str, nullable=True)
@@ -106,6 +147,26 @@ class Chat(db.Entity):
             invite_link=chat.invite_link
         )
 
+    @classmethod
+    def from_tg_cached(cls, chat):
+        return get_cached(
+            cls, chat.id,
+            first_name=chat.first_name,
+            last_name=chat.last_name,
+            username=chat.username,
+            title=chat.title,
+            invite_link=chat.invite_link
+        )
+
+    def after_insert(self):
+        cache_entity(self)
+
+    def after_update(self):
+        cache_entity(self)
+
+    def before_delete(self):
+        uncache_entity(self)
+
 
 class Message(db.Entity):
     id_in_chat = Required(int, size=64)
@@ -135,6 +196,14 @@ class Alias(db.Entity):
     regexp = Required(str)
     replace = Required(str)
 
+    def after_insert(self):
+        alias_cache.pop(self.chat.id)
+
+    def before_delete(self):
+        alias_cache.pop(self.chat.id)
+
+    after_update = after_insert
+
 
 class StickerSet(db.Entity):
     id = PrimaryKey(int, auto=True)
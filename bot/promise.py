@@ -13,6 +13,7 @@ class PromiseType(IntEnum):
     LAZY = 1
     THREAD = 2
     MANUAL = 3
+    BATCH = 4
 
 
 class PromiseError(Exception):
@@ -43,6 +44,14 @@ class Promise:
             self._thread = Thread(target=self.run)
             self._thread.start()
 
+    @property
+    def type(self):
+        return self._type
+
+    @property
+    def state(self):
+        return self._state
+
     @property
     def value(self):
         if self._state == PromiseState.PENDING:
@@ -75,6 +84,26 @@ class Promise:
             self._reject(ex)
         return self
 
+    def call(self):
+        if self._state != PromiseState.PENDING:
+            return self._state, self._value
+        res = []
+        try:
+            self._run(
+                lambda value: res.append((PromiseState.RESOLVED, value)),
+                lambda value: res.append((PromiseState.REJECTED, value))
+            )
+            if not res:
+                raise PromiseStateNotSet()
+        except Exception as ex:
+            res.append((PromiseState.REJECTED, ex))
+        return res[0]
+
+    def settle(self, state, value):
+        if self._state != PromiseState.PENDING:
+            raise PromiseError('settle: not pending (%s)' % self._state)
+        return self._set(state, value)
+
     def wait(self, timeout=-1):
         if timeout is not None and timeout < 0:
             timeout = self._timeout
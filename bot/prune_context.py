@@ -0,0 +1,146 @@
+import os
+import sys
+import sqlite3
+from time import time
+from argparse import ArgumentParser
+
+from markovchain.text import MarkovText
+from markovchain.storage import SqliteStorage
+
+
+MIN_COUNT_DEFAULT = 2
+SAMPLES_DEFAULT = 100
+RETRIES = 3
+
+
+def count_rows(db, table):
+    return db.execute('SELECT count(*) FROM %s' % table).fetchone()[0]
+
+def prune(db, min_count):
+    db.execute('DROP TABLE IF EXISTS links_merged')
+    db.execute(
+        'CREATE TABLE links_merged AS'
+        ' SELECT dataset, source, target,'
+        '  min(value) AS value, min(bvalue) AS bvalue, sum(count) AS count'
+        ' FROM links GROUP BY dataset, source, target'
+        ' HAVING sum(count) >= ?',
+        (min_count,)
+    )
+    db.execute('DELETE FROM links')
+    db.execute(
+        'INSERT INTO links (dataset, source, target, value, bvalue, count)'
+        ' SELECT dataset, source, target, value, bvalue, count'
+        ' FROM links_merged'
+    )
+    db.execute('DROP TABLE links_merged')
+    db.execute(
+        'DELETE FROM nodes'
+        ' WHERE id NOT IN (SELECT source FROM links)'
+        ' AND id NOT IN (SELECT target FROM links WHERE target IS NOT NULL)'
+    )
+    db.commit()
+    db.execute('REINDEX')
+    db.execute('VACUUM')
+    db.execute('ANALYZE')
+
+def measure(fname, samples):
+    markov = MarkovText.from_storage(SqliteStorage.load(fname))
+    try:
+        start = time()
+        for _ in range(samples):
+            try:
+                markov()
+            except KeyError:
+                break
+        return (time() - start) / samples
+    finally:
+        markov.close()
+
+def compact(fname, min_count, samples=SAMPLES_DEFAULT):
+    tmp = fname + '.prune'
+    src = sqlite3.connect(fname, isolation_level=None, timeout=60)
+    try:
+        for _ in range(RETRIES):
+            version = src.execute('PRAGMA data_version').fetchone()[0]
+            dst = sqlite3.connect(tmp)
+            try:
+                src.backup(dst)
+                links = count_rows(dst, 'links')
+                nodes = count_rows(dst, 'nodes')
+                dst.execute('PRAGMA journal_mode=DELETE')
+                prune(dst, min_count)
+                ret = {
+                    'links': (links, count_rows(dst, 'links')),
+                    'nodes': (nodes, count_rows(dst, 'nodes'))
+                }
+            finally:
+                dst.close()
+            ret['latency'] = (measure(fname, samples), measure(tmp, samples))
+            busy, _, _ = src.execute(
+                'PRAGMA wal_checkpoint(TRUNCATE)'
+            ).fetchone()
+            if busy:
+                continue
+            src.execute('BEGIN IMMEDIATE')
+            try:
+                if src.execute('PRAGMA data_version').fetchone()[0] != version:
+                    continue
+                ret['size'] = (os.path.getsize(fname), os.path.getsize(tmp))
+                os.replace(tmp, fname)
+                return ret
+            finally:
+                src.execute('ROLLBACK')
+        raise RuntimeError('%s: modified during compaction' % fname)
+    finally:
+        src.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def main(args=None):
+    parser = ArgumentParser(
+        description='prune rare transitions and compact a generator context'
+    )
+    parser.add_argument(
+        '-d', '--data-dir',
+        default=os.path.expanduser('~/.bot'),
+        help='bot data directory (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-m', '--min-count',
+        type=int, default=MIN_COUNT_DEFAULT,
+        help='remove transitions seen less than this many times'
+             ' (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-n', '--samples',
+        type=int, default=SAMPLES_DEFAULT,
+        help='texts generated to measure latency (default: %(default)s)'
+    )
+    parser.add_argument(
+        'context',
+        help='context name'
+    )
+
+    args = parser.parse_args(args)
+
+    for dir_ in ('public', 'private'):
+        fname = os.path.join(
+            args.data_dir, 'data', dir_, args.context, 'markov.db'
+        )
+        if os.path.isfile(fname):
+            break
+    else:
+        print('context not found: %s' % args.context, file=sys.stderr)
+        return 1
+
+    res = compact(fname, args.min_count, args.samples)
+    for name, (before, after) in sorted(res.items()):
+        if name == 'latency':
+            print('%s: %.2fms -> %.2fms' % (name, before * 1e3, after * 1e3))
+        else:
+            print('%s: %d -> %d' % (name, before, after))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+from time import time
+from threading import Lock, get_ident
+
+from .cache import LRUCache
+from .util import get_file_digest
+
+
+class ResultCache:
+    MAX_SIZE_DEFAULT = 256 * 1024 * 1024
+    DIGEST_CACHE_SIZE = 4096
+
+    def __init__(self, root, max_size=MAX_SIZE_DEFAULT):
+        self.logger = logging.getLogger(__name__)
+        self.root = root
+        self.max_size = max_size
+        self.lock = Lock()
+        self.digests = LRUCache(self.DIGEST_CACHE_SIZE)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.root, exist_ok=True)
+        self.db = sqlite3.connect(
+            os.path.join(self.root, 'index.db'),
+            check_same_thread=False
+        )
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT NOT NULL PRIMARY KEY,
+                size INTEGER NOT NULL,
+                used REAL NOT NULL
+            )
+        ''')
+        self.db.commit()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def digest(self, fname):
+        stat = os.stat(fname)
+        version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        try:
+            digest, digest_version = self.digests[fname]
+            if digest_version == version:
+                return digest
+        except KeyError:
+            pass
+        digest = get_file_digest(fname)
+        self.digests[fname] = digest, version
+        return digest
+
+    def key(self, name, fname, *args, ext=None):
+        data = json.dumps([name, self.digest(fname), args])
+        ret = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        if ext:
+            ret = '%s.%s' % (ret, ext)
+        return ret
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT 1 FROM results WHERE key=?', (key,)
+            ).fetchone()
+            path = self._path(key)
+            if row is not None:
+                if os.path.exists(path):
+                    self.db.execute(
+                        'UPDATE results SET used=? WHERE key=?',
+                        (time(), key)
+                    )
+                    self.db.commit()
+                    self.hits += 1
+                    return path
+                self.db.execute('DELETE FROM results WHERE key=?', (key,))
+                self.db.commit()
+            self.misses += 1
+            return None
+
+    def save(self, key, data):
+        if isinstance(data, str):
+            with open(data, 'rb') as fp:
+                data = fp.read()
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), get_ident())
+        with open(tmp, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO results (key, size, used)'
+                ' VALUES (?, ?, ?)',
+                (key, len(data), time())
+            )
+            self.db.commit()
+            self._evict()
+        return path
+
+    def _evict(self):
+        size = self.db.execute(
+            'SELECT sum(size) FROM results'
+        ).fetchone()[0] or 0
+        if size <= self.max_size:
+            return
+        rows = self.db.execute(
+            'SELECT key, size FROM results ORDER BY used'
+        ).fetchall()
+        for key, key_size in rows:
+            if size <= self.max_size:
+                break
+            self.db.execute('DELETE FROM results WHERE key=?', (key,))
+            try:
+                os.remove(self._path(key))
+            except OSError as ex:
+                self.logger.warning('evict %s: %r', key, ex)
+            size -= key_size
+            self.evictions += 1
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def stats(self):
+        with self.lock:
+            count, size = self.db.execute(
+                'SELECT count(*), sum(size) FROM results'
+            ).fetchone()
+        return {
+            'files': count,
+            'size': size or 0,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
@@ -0,0 +1,187 @@
+import re
+import logging
+import multiprocessing
+from threading import Lock
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+from .error import RegexError, RegexTimeout
+
+
+MAX_PATTERN_LENGTH = 512
+WORKER_CACHE_SIZE = 512
+WORKER_START_TIMEOUT = 30
+
+REPEAT = tuple(
+    getattr(sre_constants, name)
+    for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+    if hasattr(sre_constants, name)
+)
+
+
+def _check_parsed(parsed, in_repeat=False):
+    for op, av in parsed:
+        if op in REPEAT:
+            _, max_, sub = av
+            unbounded = max_ == sre_constants.MAXREPEAT
+            if unbounded and in_repeat:
+                raise RegexError('nested quantifiers')
+            _check_parsed(sub, in_repeat or unbounded)
+        elif op == sre_constants.SUBPATTERN:
+            _check_parsed(av[-1], in_repeat)
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                _check_parsed(branch, in_repeat)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            _check_parsed(av[1], in_repeat)
+        elif op == sre_constants.GROUPREF_EXISTS:
+            for branch in av[1:]:
+                if branch is not None:
+                    _check_parsed(branch, in_repeat)
+        elif op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+            _check_parsed(av, in_repeat)
+
+def check_regex(pattern, flags=0):
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        raise RegexError('regexp is too long: %d > %d' % (
+            len(pattern), MAX_PATTERN_LENGTH
+        ))
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error as ex:
+        raise RegexError(ex)
+    try:
+        _check_parsed(parsed)
+    except RegexError as ex:
+        raise RegexError('%s: %s' % (pattern, ex))
+    except RecursionError:
+        raise RegexError('%s: regexp is too complex' % pattern)
+
+
+def _compile(cache, pattern, flags):
+    try:
+        return cache[(pattern, flags)]
+    except KeyError:
+        if len(cache) >= WORKER_CACHE_SIZE:
+            cache.clear()
+        ret = re.compile(pattern, flags)
+        cache[(pattern, flags)] = ret
+        return ret
+
+def _worker(conn):
+    cache = {}
+    conn.send((True, None))
+    while True:
+        try:
+            method, pattern, flags, args = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            return
+        try:
+            if method == 'search':
+                res = _compile(cache, pattern, flags).search(*args) is not None
+            elif method == 'sub':
+                res = _compile(cache, pattern, flags).sub(*args)
+            elif method == 'replace':
+                re_list, res = args
+                if (pattern is None
+                        or _compile(cache, pattern, flags).search(res)):
+                    for expr, repl in re_list:
+                        res = _compile(cache, expr, flags).sub(repl, res)
+            else:
+                raise ValueError('invalid method: %r' % method)
+        except Exception as ex:
+            conn.send((False, ex))
+        else:
+            conn.send((True, res))
+
+
+class RegexWorker:
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.lock = Lock()
+        self.logger = logging.getLogger(__name__)
+        self.context = multiprocessing.get_context('spawn')
+        self.process = None
+        self.conn = None
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def _start(self):
+        self.conn, child = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker,
+            args=(child,),
+            daemon=True
+        )
+        self.process.start()
+        child.close()
+        try:
+            if not self.conn.poll(WORKER_START_TIMEOUT):
+                raise RegexError('regex worker start timeout')
+            self.conn.recv()
+        except (EOFError, OSError) as ex:
+            self._stop()
+            raise RegexError('regex worker start failed: %r' % ex)
+        except RegexError:
+            self._stop()
+            raise
+        self.logger.info('regex worker started: pid=%s', self.process.pid)
+
+    def _stop(self):
+        self.conn.close()
+        self.process.kill()
+        self.process.join()
+        self.process = None
+        self.conn = None
+
+    def close(self):
+        with self.lock:
+            if self.process is not None:
+                self._stop()
+
+    def _call(self, method, pattern, flags, *args):
+        with self.lock:
+            if self.process is None:
+                self._start()
+            self.calls += 1
+            try:
+                self.conn.send((method, pattern, flags, args))
+                if not self.conn.poll(self.timeout):
+                    self.timeouts += 1
+                    self.logger.warning(
+                        'regex timeout: %r: restarting worker', pattern
+                    )
+                    self._stop()
+                    raise RegexTimeout(pattern)
+                ok, res = self.conn.recv()
+            except (EOFError, OSError) as ex:
+                self.errors += 1
+                self.logger.error('regex worker failed: %r: restarting', ex)
+                self._stop()
+                raise RegexError('regex worker failed: %r' % ex)
+        if not ok:
+            raise res
+        return res
+
+    def search(self, pattern, string, flags=0):
+        return self._call('search', pattern, flags, string)
+
+    def sub(self, pattern, repl, string, flags=0):
+        return self._call('sub', pattern, flags, repl, string)
+
+    def replace(self, re_list, string, flags=0, match_any=None):
+        return self._call('replace', match_any, flags, re_list, string)
+
+    def stats(self):
+        return {
+            'timeout': self.timeout,
+            'calls': self.calls,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'running': self.process is not None
+        }
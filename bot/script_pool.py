@@ -0,0 +1,235 @@
+import os
+import json
+import select
+import logging
+import subprocess
+from time import time
+from threading import Lock
+from collections import defaultdict
+
+
+READY = b'script-worker 1'
+MARKER = b'import script_worker'
+MARKER_SIZE = 4096
+
+
+def supports_serve(path):
+    try:
+        with open(path, 'rb') as fp:
+            head = fp.read(MARKER_SIZE)
+    except OSError:
+        return False
+    return MARKER in head
+
+
+class ScriptWorker:
+    def __init__(self, path):
+        self.path = path
+        self.buffer = b''
+        self.process = subprocess.Popen(
+            (path, '--serve'),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+
+    def _readline(self, timeout):
+        fd = self.process.stdout.fileno()
+        deadline = time() + timeout
+        while b'\n' not in self.buffer:
+            remaining = deadline - time()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.path, timeout)
+            ready, _, _ = select.select((fd,), (), (), remaining)
+            if not ready:
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line
+
+    def start(self, timeout):
+        try:
+            return self._readline(timeout) == READY
+        except subprocess.TimeoutExpired:
+            return False
+
+    def run(self, args, timeout):
+        self.process.stdin.write(json.dumps(args).encode('utf-8') + b'\n')
+        self.process.stdin.flush()
+        line = self._readline(timeout)
+        if line is None:
+            raise subprocess.CalledProcessError(
+                self.process.wait(), self.path, b'<worker exited>'
+            )
+        res = json.loads(line.decode('utf-8'))
+        output = res['output'].encode('utf-8')
+        if res['status']:
+            raise subprocess.CalledProcessError(
+                res['status'], [self.path] + args, output
+            )
+        return output
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class ScriptPool:
+    WORKERS_DEFAULT = 2
+    TERMINATE_TIMEOUT = 5
+
+    def __init__(self, root, timeout, workers=WORKERS_DEFAULT):
+        self.logger = logging.getLogger(__name__)
+        self.root = root
+        self.timeout = timeout
+        self.workers = workers
+        self.lock = Lock()
+        self.idle = defaultdict(list)
+        self.oneshot = set()
+        self.serving = set()
+        self.closed = False
+        self.stats_ = {
+            'jobs': 0,
+            'oneshot': 0,
+            'started': 0,
+            'timeouts': 0,
+            'errors': 0
+        }
+
+    def _acquire(self, name):
+        path = os.path.join(self.root, name)
+        with self.lock:
+            if name in self.oneshot:
+                return None
+            if name not in self.serving:
+                if not supports_serve(path):
+                    self.logger.info('script %s: no worker mode', name)
+                    self.oneshot.add(name)
+                    return None
+                self.serving.add(name)
+            try:
+                return self.idle[name].pop()
+            except IndexError:
+                pass
+        worker = ScriptWorker(path)
+        if not worker.start(self.timeout):
+            self.logger.error('script %s: worker start failed', name)
+            worker.kill()
+            self.stats_['errors'] += 1
+            return None
+        self.logger.info('script %s: worker %d', name, worker.process.pid)
+        self.stats_['started'] += 1
+        return worker
+
+    def _release(self, name, worker):
+        with self.lock:
+            if not self.closed and len(self.idle[name]) < self.workers:
+                self.idle[name].append(worker)
+                return
+        worker.close()
+
+    def run(self, name, args, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        worker = self._acquire(name) if self.workers else None
+        self.stats_['jobs'] += 1
+        if worker is None:
+            self.stats_['oneshot'] += 1
+            return subprocess.check_output(
+                [os.path.join(self.root, name)] + args,
+                stderr=subprocess.STDOUT,
+                timeout=timeout
+            )
+        try:
+            ret = worker.run(args, timeout)
+        except subprocess.TimeoutExpired:
+            self.stats_['timeouts'] += 1
+            worker.kill()
+            raise
+        except subprocess.CalledProcessError:
+            self.stats_['errors'] += 1
+            if worker.process.poll() is not None:
+                raise
+            self._release(name, worker)
+            raise
+        except Exception:
+            self.stats_['errors'] += 1
+            worker.kill()
+            raise
+        self._release(name, worker)
+        return ret
+
+    def stream(self, name, args, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        self.stats_['jobs'] += 1
+        self.stats_['oneshot'] += 1
+        cmd = [os.path.join(self.root, name)] + args
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+        fd = process.stdout.fileno()
+        deadline = time() + timeout
+        output = []
+        try:
+            while True:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    self.stats_['timeouts'] += 1
+                    raise subprocess.TimeoutExpired(
+                        cmd, timeout, b''.join(output)
+                    )
+                ready, _, _ = select.select((fd,), (), (), remaining)
+                if not ready:
+                    continue
+                data = os.read(fd, 65536)
+                if not data:
+                    break
+                output.append(data)
+                yield data
+            status = process.wait(max(0, deadline - time()))
+            if status:
+                self.stats_['errors'] += 1
+                raise subprocess.CalledProcessError(
+                    status, cmd, b''.join(output)
+                )
+        finally:
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(self.TERMINATE_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            process.stdout.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            workers = [
+                worker
+                for workers in self.idle.values()
+                for worker in workers
+            ]
+            self.idle.clear()
+        for worker in workers:
+            worker.close()
+
+    def stats(self):
+        ret = dict(self.stats_)
+        with self.lock:
+            ret['idle'] = sum(len(workers) for workers in self.idle.values())
+        ret['workers'] = self.workers
+        return ret
@@ -1,17 +1,20 @@
 import os
 import re
 import json
+import sqlite3
 import hashlib
 import logging
 from time import time, sleep
 from threading import Lock
-from collections import defaultdict
+from contextlib import contextmanager
 from urllib.parse import urlsplit, urlencode
 
 import urllib3
 from urllib3.contrib.socks import SOCKSProxyManager
 
+from .cache import LRUCache
 from .error import SearchError
+from .promise import Promise, PromiseType as PT, PromiseState as PS
 
 
 def get_proxy_manager(proxy):
@@ -33,25 +36,184 @@ def request(http, method, url, **kwargs):
         )
     return ret.data
 
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        if rate <= 0 or burst < 1:
+            raise ValueError('invalid rate limit: %r/%r' % (rate, burst))
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.time = time()
+        self.lock = Lock()
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def acquire(self):
+        with self.lock:
+            now = time()
+            self.tokens = min(
+                self.burst,
+                self.tokens + (now - self.time) * self.rate
+            )
+            self.time = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            if wait > 0:
+                self.waits += 1
+                self.wait_time += wait
+        if wait > 0:
+            sleep(wait)
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'waits': self.waits,
+            'wait_time': '%.3f' % self.wait_time
+        }
+
+
+class SearchCache:
+    MAX_SIZE_DEFAULT = 1024
+    MAX_DISK_SIZE_DEFAULT = 65536
+    TTL_DEFAULT = 86400
+
+    def __init__(self, max_size=MAX_SIZE_DEFAULT, ttl=TTL_DEFAULT,
+                 path=None, max_disk_size=MAX_DISK_SIZE_DEFAULT):
+        self.ttl = ttl
+        self.max_disk_size = max_disk_size
+        self.memory = LRUCache(max_size, ttl)
+        self.lock = Lock()
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS search_cache (
+                    query TEXT NOT NULL PRIMARY KEY,
+                    results TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    used REAL NOT NULL
+                )
+            ''')
+            self.db.commit()
+
+    def _expired(self, results):
+        return self.ttl is not None and time() - results.created >= self.ttl
+
+    def _load(self, query):
+        if self.db is None:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                'SELECT results FROM search_cache WHERE query=?', (query,)
+            ).fetchone()
+            if row is not None:
+                self.db.execute(
+                    'UPDATE search_cache SET used=? WHERE query=?',
+                    (time(), query)
+                )
+                self.db.commit()
+        if row is None:
+            self.disk_misses += 1
+            return None
+        results = SearchResults.from_json(json.loads(row[0]))
+        if self._expired(results):
+            self.disk_misses += 1
+            return None
+        self.disk_hits += 1
+        return results
+
+    def get(self, query):
+        results = self.memory.get(query)
+        if results is None or self._expired(results):
+            results = self._load(query)
+            if results is None:
+                results = SearchResults()
+            self.memory[query] = results
+        return results
+
+    def save(self, query, results):
+        if self.db is None:
+            return
+        now = time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO search_cache'
+                ' (query, results, created, used) VALUES (?, ?, ?, ?)',
+                (query, json.dumps(results.to_json()), results.created, now)
+            )
+            if self.ttl is not None:
+                self.db.execute(
+                    'DELETE FROM search_cache WHERE created < ?',
+                    (now - self.ttl,)
+                )
+            self.db.execute(
+                'DELETE FROM search_cache WHERE query NOT IN ('
+                ' SELECT query FROM search_cache ORDER BY used DESC LIMIT ?'
+                ')',
+                (self.max_disk_size,)
+            )
+            self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            with self.lock:
+                self.db.close()
+                self.db = None
+
+    def stats(self):
+        ret = self.memory.stats()
+        if self.db is not None:
+            with self.lock:
+                ret['disk_size'] = self.db.execute(
+                    'SELECT count(*) FROM search_cache'
+                ).fetchone()[0]
+            ret['disk_max_size'] = self.max_disk_size
+            ret['disk_hits'] = self.disk_hits
+            ret['disk_misses'] = self.disk_misses
+        return ret
+
 
 class Search:
     DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 6.1; rv:60.0) Gecko/20100101 Firefox/60.0'
 
-    def __init__(self, throttle=1, proxy=None, headers=None):
+    RATE_DEFAULT = 1.0
+    BURST_DEFAULT = 2
+    PREFETCH_DEFAULT = 5
+
+    def __init__(self, rate=RATE_DEFAULT, burst=BURST_DEFAULT,
+                 proxy=None, headers=None, prefetch=PREFETCH_DEFAULT,
+                 cache_size=SearchCache.MAX_SIZE_DEFAULT,
+                 cache_ttl=SearchCache.TTL_DEFAULT,
+                 cache_path=None):
         if headers is None:
             headers = {}
         if 'User-Agent' not in headers:
             headers['User-Agent'] = self.DEFAULT_USER_AGENT
+        headers['Referer'] = 'https://duckduckgo.com/'
         self.lock = Lock()
+        self.query_locks = {}
         self.logger = logging.getLogger(__name__)
-        self.last_used = time()
+        self.limiter = TokenBucket(rate, burst)
         self.http = get_proxy_manager(proxy)
         self.headers = headers
-        self.throttle = throttle
-        self.cache = defaultdict(SearchResults)
+        self.prefetch = prefetch
+        self.prefetch_stats = {
+            'started': 0,
+            'waits': 0,
+            'errors': 0
+        }
+        self.cache = SearchCache(cache_size, cache_ttl, cache_path)
 
     def _request_json(self, results, url, fields=None):
         self.logger.info('request search json %s %r', url, fields)
+        self.limiter.acquire()
         data = request(self.http, 'GET', url,
                        headers=self.headers, fields=fields)
         data = json.loads(data.decode('utf-8'))
@@ -75,10 +237,9 @@ class Search:
             except KeyError as ex:
                 self.logger.warning('results: %r: %r', ex, res)
 
-    def _request(self, query):
-        results = self.cache[query]
-        self.headers['Referer'] = 'https://duckduckgo.com/'
+    def _request(self, query, results):
         if results.next_url is None:
+            self.limiter.acquire()
             data = request(
                 self.http,
                 'GET',
@@ -108,22 +269,58 @@ class Search:
             url = results.next_url
             fields = None
         self._request_json(results, url, fields)
+        self.cache.save(query, results)
+
+    def close(self):
+        self.cache.close()
+
+    def _prefetch(self, query, results):
+        def prefetch(resolve, _):
+            try:
+                self._request(query, results)
+            except Exception as ex:
+                self.logger.warning('prefetch %r: %r', query, ex)
+                self.prefetch_stats['errors'] += 1
+            resolve(None)
 
-    def _throttle(self):
-        dt = time() - self.last_used
-        if dt < self.throttle:
-            sleep(self.throttle - dt)
-        self.last_used = time()
+        self.logger.info('prefetch %r', query)
+        self.prefetch_stats['started'] += 1
+        results.pending = Promise(prefetch, PT.THREAD)
+
+    def _wait_prefetch(self, results):
+        pending = results.pending
+        if pending is not None:
+            if pending.state == PS.PENDING:
+                self.prefetch_stats['waits'] += 1
+            pending.wait()
+            results.pending = None
+
+    @contextmanager
+    def _lock_query(self, query):
+        with self.lock:
+            try:
+                lock, users = self.query_locks[query]
+            except KeyError:
+                lock, users = Lock(), 0
+            self.query_locks[query] = lock, users + 1
+        try:
+            with lock:
+                yield
+        finally:
+            with self.lock:
+                lock, users = self.query_locks[query]
+                if users > 1:
+                    self.query_locks[query] = lock, users - 1
+                else:
+                    del self.query_locks[query]
 
     def __getitem__(self, query):
-        query = query.strip().lower()
-        return self.cache[query]
+        return self.cache.get(normalize_query(query))
 
     def __call__(self, query, offset):
-        with self.lock:
-            self._throttle()
-            query = query.strip().lower()
-            results = self.cache[query]
+        query = normalize_query(query)
+        with self._lock_query(query):
+            results = self.cache.get(query)
             while True:
                 try:
                     self.logger.info('get next result %r', query)
@@ -138,17 +335,29 @@ class Search:
                         ret = results[-1]
                         break
                     else:
+                        self._wait_prefetch(results)
+                        if offset < len(results) or results.full:
+                            continue
                         self.logger.info('request more results')
-                        self._request(query)
+                        self._request(query, results)
+            if (self.prefetch
+                    and (results.pending is None
+                         or results.pending.state != PS.PENDING)
+                    and not results.full
+                    and results.next_url is not None
+                    and offset >= len(results) - self.prefetch):
+                self._prefetch(query, results)
             is_last = results.full and offset >= len(results) - 1
             return ret, is_last
 
 
 class SearchResults:
-    def __init__(self, results=None, full=False, next_url=None):
+    def __init__(self, results=None, full=False, next_url=None, created=None):
         self.items = results if results is not None else []
         self.full = full
         self.next_url = next_url
+        self.created = created if created is not None else time()
+        self.pending = None
 
     def __len__(self):
         return len(self.items)
@@ -156,6 +365,29 @@ class SearchResults:
     def __getitem__(self, i):
         return self.items[i]
 
+    def to_json(self):
+        return {
+            'items': [
+                [res.thumbnail, res.image, res.url, res.title]
+                for res in self.items
+            ],
+            'full': self.full,
+            'next_url': self.next_url,
+            'created': self.created
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            [
+                SearchResult(i, *item)
+                for i, item in enumerate(data['items'])
+            ],
+            data['full'],
+            data['next_url'],
+            data['created']
+        )
+
 
 class SearchResult:
     def __init__(self, offset, thumbnail, image, url, title):
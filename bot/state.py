@@ -5,11 +5,10 @@ import time
 import random
 import logging
 import tempfile
-import subprocess
 from collections import defaultdict
 from threading import Lock
 
-from pony.orm import db_session
+from pony.orm import db_session, delete
 from telegram import ChatAction, TelegramError
 
 from .util import (
@@ -19,18 +18,30 @@ from .util import (
     get_message_filename,
     reply_text,
     reply_photo,
+    get_permission,
+    file_id_cache,
+    download_stats,
+    RegexReplace,
     Permission as P,
     FILE_TYPES
 )
 from .models import (
     connect, flush, get_db_path, get_or_create, update_or_create,
-    StickerSet, Sticker, User, UserPhone, Chat, Message,
+    is_cached, is_fresh,
+    clear_caches, entity_cache, permission_cache, alias_cache,
+    StickerSet, Sticker, User, UserPhone, Chat, Message, Alias,
     SearchQuery, SearchLog
 )
 from .context_cache import ContextCache
 from .formatter import Formatter
-from .error import CommandError
+from .error import CommandError, RegexError, RegexTimeout
 from .search import Search
+from .media_cache import MediaCache
+from .script_pool import ScriptPool
+from .image_filter import ImageFilter
+from .result_cache import ResultCache
+from .safe_regex import RegexWorker
+from .learner import Learner
 from .promise import Promise
 
 
@@ -38,6 +49,7 @@ class BotState:
     ASYNC_MAX_DEFAULT = 4
     PROCESS_TIMEOUT_DEFAULT = 60
     QUERY_TIMEOUT_DEFAULT = 10
+    REGEX_TIMEOUT_DEFAULT = 0.5
     RE_COMMAND = re.compile(r'^/([^@\s]+)')
     RE_COMMAND_NO_ARGS = re.compile(r'^/([^@\s]+)(@\S+)?\s*$')
 
@@ -47,6 +59,14 @@ class BotState:
                  async_max=ASYNC_MAX_DEFAULT,
                  process_timeout=PROCESS_TIMEOUT_DEFAULT,
                  query_timeout=QUERY_TIMEOUT_DEFAULT,
+                 regex_timeout=REGEX_TIMEOUT_DEFAULT,
+                 context_cache_size=ContextCache.MAX_SIZE_DEFAULT,
+                 context_cache_ttl=None,
+                 learn_workers=0,
+                 script_workers=ScriptPool.WORKERS_DEFAULT,
+                 filter_workers=None,
+                 search_rate=Search.RATE_DEFAULT,
+                 search_burst=Search.BURST_DEFAULT,
                  proxy=None,
                  user_update_interval=86400,
                  chat_update_interval=86400,
@@ -62,7 +82,13 @@ class BotState:
         self.chat_update_interval = chat_update_interval
         self.sticker_set_update_interval = sticker_set_update_interval
         self.logger = logging.getLogger('bot.state')
-        self.context = ContextCache(os.path.join(self.root, 'data'))
+        self.learner = Learner(learn_workers) if learn_workers else None
+        self.context = ContextCache(
+            os.path.join(self.root, 'data'),
+            context_cache_size,
+            context_cache_ttl,
+            self.learner
+        )
 
         self.default_file_dir = os.path.join(self.root, 'document')
         self.file_dir = defaultdict(lambda: self.default_file_dir)
@@ -70,7 +96,17 @@ class BotState:
         self.db_path = get_db_path(self.root)
         connect(self.db_path)
 
-        self.search = Search(proxy=proxy)
+        self.search = Search(
+            search_rate,
+            search_burst,
+            proxy=proxy,
+            cache_path=os.path.join(self.root, 'search.db')
+        )
+        self.media = MediaCache(
+            os.path.join(self.root, 'media_cache'),
+            self.search.http,
+            dict(self.search.headers)
+        )
 
         formatter = os.path.join(
             self.context.root_settings,
@@ -89,6 +125,20 @@ class BotState:
         self.async_max = async_max
         self.process_timeout = process_timeout
         self.query_timeout = query_timeout
+        self.regex = RegexWorker(regex_timeout) if regex_timeout else None
+        self.regex_disabled = 0
+        self.scripts = ScriptPool(
+            os.path.join(self.root, 'scripts'),
+            process_timeout,
+            script_workers
+        )
+        self.results = ResultCache(os.path.join(self.root, 'result_cache'))
+        self.image_filter = None
+        if filter_workers != 0:
+            if ImageFilter.is_available():
+                self.image_filter = ImageFilter(filter_workers)
+            else:
+                self.logger.warning('image filter: pillow is not installed')
 
         os.makedirs(self.default_file_dir, exist_ok=True)
         for type_ in FILE_TYPES:
@@ -100,6 +150,44 @@ class BotState:
         self.logger.info('saving bot state')
         flush()
 
+    def close(self):
+        self.logger.info('closing bot state')
+        self.context.close()
+        self.search.close()
+        self.media.close()
+        self.scripts.close()
+        self.results.close()
+        if self.image_filter is not None:
+            self.image_filter.close()
+        if self.learner is not None:
+            self.learner.close()
+        if self.regex is not None:
+            self.regex.close()
+
+    def get_stats(self):
+        ret = {
+            'entity cache': entity_cache.stats(),
+            'permission cache': permission_cache.stats(),
+            'alias cache': alias_cache.stats(),
+            'context cache': self.context.stats(),
+            'search cache': self.search.cache.stats(),
+            'search rate limit': self.search.limiter.stats(),
+            'search prefetch': self.search.prefetch_stats,
+            'media cache': self.media.stats(),
+            'file id cache': file_id_cache.stats(),
+            'scripts': self.scripts.stats(),
+            'result cache': self.results.stats(),
+            'downloads': dict(download_stats)
+        }
+        if self.image_filter is not None:
+            ret['image filter'] = self.image_filter.stats()
+        if self.regex is not None:
+            ret['regex'] = self.regex.stats()
+            ret['regex']['disabled'] = self.regex_disabled
+        if self.learner is not None:
+            ret['learner'] = self.learner.stats()
+        return ret
+
     def run_async(self, func, *args, **kwargs):
         def _run_async():
             try:
@@ -187,7 +275,9 @@ class BotState:
 
     @db_session
     def learn_user(self, data):
-        return update_or_create(
+        if is_fresh(User, data.id, self.user_update_interval):
+            return
+        update_or_create(
             User, data.id, self.user_update_interval,
             first_name=data.first_name, last_name=data.last_name,
             username=data.username
@@ -221,7 +311,9 @@ class BotState:
 
     @db_session
     def learn_chat(self, chat):
-        return update_or_create(
+        if is_fresh(Chat, chat.id, self.chat_update_interval):
+            return
+        update_or_create(
             Chat, chat.id, self.chat_update_interval,
             first_name=chat.first_name,
             last_name=chat.last_name,
@@ -245,7 +337,8 @@ class BotState:
         if message.from_user is None:
             user = None
         else:
-            user = self.learn_user(message.from_user)
+            self.learn_user(message.from_user)
+            user = message.from_user.id
 
         timestamp = int(message.date.timestamp())
         text = message.text or message.caption
@@ -276,13 +369,19 @@ class BotState:
     def learn_inline_query(self, query):
         timestamp = int(time.time())
         inline_query = query.query
-        user = self.learn_user(query.from_user)
+        self.learn_user(query.from_user)
         return Message(
             id_in_chat=-1,
-            chat=None, user=user,
+            chat=None, user=query.from_user.id,
             timestamp=timestamp, inline_query=inline_query
         )
 
+    def is_known(self, update):
+        chat = update.effective_chat
+        user = update.effective_user
+        return ((chat is None or is_cached(Chat, chat.id))
+                and (user is None or is_cached(User, user.id)))
+
     @db_session
     def learn_update(self, update):
         try:
@@ -296,12 +395,13 @@ class BotState:
                 self.learn_inline_query(update.inline_query)
         except Exception as ex:
             self.logger.error('learn_update: %r', ex)
+            clear_caches()
             raise
 
     @db_session
     def learn_search_query(self, query, user, reset):
         query = query.strip().lower()
-        user = self.learn_user(user)
+        self.learn_user(user)
         query_ = SearchQuery.get(query=query)
         if query_ is None:
             query_ = SearchQuery(query=query)
@@ -327,27 +427,84 @@ class BotState:
             if self.RE_COMMAND_NO_ARGS.match(msg):
                 msg = '%s %s' % (msg, reply)
 
-        chat = Chat.from_tg(chat)
-        for alias in chat.aliases:
-            msg = re.sub(alias.regexp, alias.replace, msg, flags=re.I)
+        try:
+            msg = self.get_aliases(chat)(msg)
+        except RegexTimeout as ex:
+            self.disable_alias(update.message, ex.args[0])
+        except RegexError as ex:
+            self.logger.error('apply_aliases: %r', ex)
 
         if reply and self.RE_COMMAND_NO_ARGS.match(msg):
             msg = '%s %s' % (msg, reply)
 
         update.message.text = msg
 
+    @db_session
+    def get_aliases(self, chat):
+        ret = alias_cache.get(chat.id)
+        if ret is None:
+            aliases = Chat.from_tg(chat).aliases.select().order_by(Alias.id)
+            ret = RegexReplace(
+                [(alias.regexp, alias.replace) for alias in aliases],
+                re.I, self.regex
+            )
+            alias_cache[chat.id] = ret
+        return ret
+
+    @db_session
+    def disable_alias(self, message, regexp):
+        chat_id = message.chat.id
+        self.logger.warning('disable alias: chat=%s regexp=%r', chat_id, regexp)
+        delete(a for a in Alias if a.chat.id == chat_id and a.regexp == regexp)
+        self.regex_disabled += 1
+        self._report_regex_timeout(message, 'alias', regexp)
+
+    @db_session
+    def disable_trigger(self, message, trigger):
+        chat = Chat.from_tg(message.chat)
+        self.logger.warning('disable trigger: chat=%s regexp=%r', chat.id, trigger)
+        if chat.trigger == trigger:
+            chat.trigger = None
+        self.regex_disabled += 1
+        self._report_regex_timeout(message, 'trigger', trigger)
+
+    def _report_regex_timeout(self, message, type_, regexp):
+        try:
+            message.reply_text(
+                '%s disabled: regexp timeout: %s' % (type_, regexp),
+                quote=False
+            )
+        except TelegramError as ex:
+            self.logger.error('report regex timeout: %r', ex)
+
+    def search_trigger(self, message, trigger, text):
+        if self.regex is None:
+            return re.search(trigger, text, re.I) is not None
+        try:
+            return self.regex.search(trigger, text, re.I)
+        except RegexTimeout:
+            self.disable_trigger(message, trigger)
+            return False
+        except RegexError as ex:
+            self.logger.error('search_trigger: %r', ex)
+            return False
+
     @db_session
     def get_chat_context(self, chat, throw=True):
-        if not isinstance(chat, Chat):
-            chat = Chat.from_tg(chat)
-        if chat.context is None:
+        if isinstance(chat, Chat):
+            name = chat.context
+        else:
+            name = Chat.from_tg_cached(chat)['context']
+        if name is None:
             if throw:
                 raise CommandError('generator context is not set')
             return None
         try:
-            return self.context.get(chat.context)
+            return self.context.get(name)
         except Exception as ex:
-            self.logger.error('error loading context %r: %r', chat.context, ex)
+            self.logger.error('error loading context %r: %r', name, ex)
+            if not isinstance(chat, Chat):
+                chat = Chat.from_tg(chat)
             chat.context = None
             chat.order = 0
             chat.learn = False
@@ -364,8 +521,7 @@ class BotState:
         quote = False
         text = get_message_text(message)
 
-        user = User.from_tg(message.from_user)
-        permission = user.permission
+        permission = get_permission(message.from_user)
 
         if permission <= P.BANNED:
             self.logger.info('ignored user: reply=False')
@@ -383,9 +539,9 @@ class BotState:
                 quote = True
                 reply = True
             else:
-                chat = Chat.from_tg(message.chat)
-                trigger = chat.trigger
-                if trigger is not None and re.search(trigger, text, re.I):
+                trigger = Chat.from_tg_cached(message.chat)['trigger']
+                if (trigger is not None
+                        and self.search_trigger(message, trigger, text)):
                     self.logger.info('trigger: reply=True')
                     quote = True
                     reply = True
@@ -393,11 +549,11 @@ class BotState:
         return reply, quote
 
     def random_text(self, update):
-        chat = Chat.from_tg(update.message.chat)
-        context = self.get_chat_context(chat)
+        context = self.get_chat_context(update.message.chat)
+        chat = Chat.from_tg_cached(update.message.chat)
         try:
             return (
-                context.random_text(chat.order, chat.reply_max_length),
+                context.random_text(chat['order'], chat['reply_max_length']),
                 True
             )
         except KeyError as ex:
@@ -410,6 +566,30 @@ class BotState:
             return None
         return res[0].file_id
 
+    def _filter_image(self, fname, output, settings):
+        key = self.results.key(
+            'filter', fname,
+            settings['filter_size'],
+            self.results.digest(settings['filter']),
+            ext='jpg'
+        )
+        ret = self.results.get(key)
+        if ret is not None:
+            return ret
+        if self.image_filter is not None:
+            img = self.image_filter(
+                fname,
+                settings['filter_size'],
+                settings['filter'],
+                self.process_timeout
+            )
+        else:
+            self.scripts.run('filter', [
+                settings['filter_size'], settings['filter'], fname, output
+            ])
+            img = output
+        return self.results.save(key, img)
+
     def filter_image(self, update, download, settings, quote=False):
         output = os.path.join(
             self.tmp_dir,
@@ -426,15 +606,9 @@ class BotState:
             self.logger.error('send_chat_action: %r', ex)
 
         download.then(
-            lambda fname: subprocess.check_output(
-                (os.path.join(self.root, 'scripts', 'filter'),
-                 settings['filter_size'], settings['filter'], fname, output
-                ),
-                stderr=subprocess.STDOUT,
-                timeout=self.process_timeout
-            )
+            lambda fname: self._filter_image(fname, output, settings)
         ).then(
-            lambda _: reply_photo(update, output, quote)
+            lambda img: reply_photo(update, img, quote)
         ).catch(
             lambda err: reply_text(update, err, quote)
         ).wait()
@@ -449,10 +623,9 @@ class BotState:
         message = update.message
         reply, quote = self._need_reply(message)
 
-        chat = Chat.from_tg(message.chat)
-
-        context = self.get_chat_context(chat, False)
-        settings = self.get_chat_settings(chat)
+        context = self.get_chat_context(message.chat, False)
+        settings = self.get_chat_settings(message.chat)
+        chat = Chat.from_tg_cached(message.chat)
         text = message.text
         res = None
 
@@ -463,24 +636,30 @@ class BotState:
 
         if create_private or self.context.has_private(message.chat):
             private = self.context.get_private(message.chat)
-            self.logger.info('learn private')
-            private.learn_text(text)
+            if private.is_duplicate(text):
+                self.logger.info('learn private: duplicate')
+            else:
+                self.logger.info('learn private')
+                private.learn_text(text)
 
         if context is not None:
             if reply:
                 try:
                     reply = context.reply_text(
-                        text, chat.order,
-                        chat.reply_max_length
+                        text, chat['order'],
+                        chat['reply_max_length']
                     )
                     self.logger.info('reply: "%s"', reply)
                     if reply:
                         res = (reply, quote)
                 except KeyError as ex:
                     self.logger.error(ex)
-            if chat.learn and not context.is_private:
-                self.logger.info('learn')
-                context.learn_text(text)
+            if chat['learn'] and not context.is_private:
+                if context.is_duplicate(text):
+                    self.logger.info('learn: duplicate')
+                else:
+                    self.logger.info('learn')
+                    context.learn_text(text)
         elif reply:
             self.logger.info('no context')
             raise CommandError('generator context is not set')
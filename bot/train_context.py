@@ -0,0 +1,253 @@
+import os
+import sys
+import json
+import sqlite3
+import multiprocessing
+from argparse import ArgumentParser
+from collections import Counter, deque
+
+from tqdm import tqdm
+from pony.orm import db_session
+from markovchain.text import MarkovText
+from markovchain.storage import SqliteStorage
+
+from .models import connect, get_db_path, Message
+
+
+CHUNK_SIZE_DEFAULT = 10000
+
+_markov = None
+
+
+def _init_worker(settings):
+    global _markov
+    _markov = MarkovText.from_storage(SqliteStorage(settings=settings))
+
+def tokenize(texts):
+    storage = _markov.storage
+    counts = Counter()
+    for text in texts:
+        for dataset, src, dst in _markov.parser(_markov.scanner(text)):
+            src = list(src)
+            if dst is None:
+                target = None
+            else:
+                target = storage.join_state(src[1:] + [dst])
+            counts[(
+                dataset, storage.join_state(src), target, dst, src[0]
+            )] += 1
+    return [key + (count,) for key, count in counts.items()]
+
+
+def create_tables(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS train_progress (
+            key TEXT NOT NULL PRIMARY KEY,
+            message INTEGER NOT NULL
+        )
+    ''')
+    db.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS train_links (
+            dataset TEXT,
+            source TEXT,
+            target TEXT,
+            value TEXT,
+            bvalue TEXT,
+            count INTEGER
+        )
+    ''')
+
+def get_progress(db, key):
+    row = db.execute(
+        'SELECT message FROM train_progress WHERE key=?', (key,)
+    ).fetchone()
+    return 0 if row is None else row[0]
+
+def merge_links(db, links, key, message):
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        db.execute('DELETE FROM train_links')
+        db.executemany(
+            'INSERT INTO train_links VALUES (?, ?, ?, ?, ?, ?)', links
+        )
+        db.execute(
+            'INSERT OR IGNORE INTO nodes (value)'
+            ' SELECT source FROM train_links'
+            ' UNION SELECT target FROM train_links WHERE target IS NOT NULL'
+        )
+        db.execute(
+            'INSERT INTO datasets (key)'
+            ' SELECT DISTINCT dataset FROM train_links'
+            ' WHERE dataset NOT IN (SELECT key FROM datasets)'
+        )
+        db.execute('DROP TABLE IF EXISTS train_ids')
+        db.execute(
+            'CREATE TEMP TABLE train_ids AS'
+            ' SELECT d.id AS dataset, s.id AS source, t.id AS target,'
+            '  l.value AS value, l.bvalue AS bvalue, l.count AS count'
+            ' FROM train_links l'
+            ' JOIN datasets d ON d.key = l.dataset'
+            ' JOIN nodes s ON s.value = l.source'
+            ' LEFT JOIN nodes t ON t.value = l.target'
+        )
+        db.execute(
+            'UPDATE links SET count = links.count + i.count'
+            ' FROM train_ids i'
+            ' WHERE links.source = i.source AND links.dataset = i.dataset'
+            '  AND links.target IS i.target'
+        )
+        db.execute(
+            'INSERT INTO links (dataset, source, target, value, bvalue, count)'
+            ' SELECT dataset, source, target, value, bvalue, count'
+            ' FROM train_ids i WHERE NOT EXISTS ('
+            '  SELECT 1 FROM links l'
+            '  WHERE l.source = i.source AND l.dataset = i.dataset'
+            '   AND l.target IS i.target'
+            ' )'
+        )
+        db.execute(
+            'INSERT OR REPLACE INTO train_progress (key, message)'
+            ' VALUES (?, ?)',
+            (key, message)
+        )
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+
+
+def get_query(chat_id, since, until):
+    query = Message.select(
+        lambda m: m.chat.id == chat_id and m.text is not None
+    )
+    if since is not None:
+        query = query.filter(lambda m: m.timestamp >= since)
+    if until is not None:
+        query = query.filter(lambda m: m.timestamp < until)
+    return query
+
+def count_messages(chat_id, since, until, start):
+    with db_session:
+        return get_query(chat_id, since, until).filter(
+            lambda m: m.id > start
+        ).count()
+
+def read_chunks(chat_id, since, until, start, size):
+    while True:
+        with db_session:
+            messages = get_query(chat_id, since, until).filter(
+                lambda m: m.id > start
+            ).order_by(Message.id)[:size]
+            chunk = [(msg.id, msg.text) for msg in messages]
+        if not chunk:
+            return
+        start = chunk[-1][0]
+        yield start, len(chunk), [
+            text for _, text in chunk
+            if text.strip() and not text.startswith('/')
+        ]
+
+
+def open_context(root, settings):
+    fname = os.path.join(root, 'markov.db')
+    if not os.path.exists(fname):
+        os.makedirs(root, exist_ok=True)
+        with open(settings, 'rt') as fp:
+            settings = json.load(fp)
+        storage = SqliteStorage(db=fname, settings=settings)
+        MarkovText.from_storage(storage).save()
+        storage.close()
+    storage = SqliteStorage.load(fname)
+    settings = storage.settings
+    storage.close()
+    db = sqlite3.connect(fname, isolation_level=None)
+    create_tables(db)
+    return db, settings
+
+def train_chat(db, pool, jobs, chat_id, since, until, size, reset):
+    key = '%s:%s:%s' % (chat_id, since, until)
+    start = 0 if reset else get_progress(db, key)
+    total = count_messages(chat_id, since, until, start)
+    pending = deque()
+    with tqdm(total=total, desc=str(chat_id), unit='msg') as progress:
+        for last, count, texts in read_chunks(
+                chat_id, since, until, start, size):
+            pending.append((last, count, pool.apply_async(tokenize, (texts,))))
+            while len(pending) > jobs or (pending and pending[0][2].ready()):
+                last, count, res = pending.popleft()
+                merge_links(db, res.get(), key, last)
+                progress.update(count)
+        while pending:
+            last, count, res = pending.popleft()
+            merge_links(db, res.get(), key, last)
+            progress.update(count)
+
+
+def main(args=None):
+    parser = ArgumentParser(
+        description='train a generator context on logged chat messages'
+    )
+    parser.add_argument(
+        '-d', '--data-dir',
+        default=os.path.expanduser('~/.bot'),
+        help='bot data directory (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-c', '--chat',
+        type=int, action='append', required=True,
+        help='chat id (can be repeated)'
+    )
+    parser.add_argument(
+        '--since',
+        type=int, default=None,
+        help='min message timestamp (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--until',
+        type=int, default=None,
+        help='max message timestamp, exclusive (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-s', '--chunk-size',
+        type=int, default=CHUNK_SIZE_DEFAULT,
+        help='messages per chunk (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int, default=None,
+        help='tokenizer processes (default: number of CPUs)'
+    )
+    parser.add_argument(
+        '--reset',
+        action='store_true',
+        help='ignore saved progress'
+    )
+    parser.add_argument(
+        'context',
+        help='context name'
+    )
+
+    args = parser.parse_args(args)
+    if args.jobs is None:
+        args.jobs = os.cpu_count()
+
+    connect(get_db_path(args.data_dir))
+    db, settings = open_context(
+        os.path.join(args.data_dir, 'data', 'public', args.context),
+        os.path.join(args.data_dir, 'settings', 'markov.json')
+    )
+
+    try:
+        with multiprocessing.get_context('spawn').Pool(
+                args.jobs, _init_worker, (settings,)) as pool:
+            for chat_id in args.chat:
+                train_chat(
+                    db, pool, args.jobs, chat_id,
+                    args.since, args.until, args.chunk_size, args.reset
+                )
+    finally:
+        db.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
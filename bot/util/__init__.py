@@ -1,5 +1,5 @@
 from .enums import Permission, CommandType
-from .misc import re_list_compile, chunks, configure_logger
+from .misc import re_list_compile, RegexReplace, chunks, configure_logger
 from .string import (
     srange, intersperse, intersperse_printable,
     flatten_html, is_phone_number, trunc,
@@ -11,7 +11,11 @@ from .tg import (
     get_tokens,
     get_chat_title, get_user_name, get_message_filename,
     get_message_text, get_command_args, get_file, download_file,
+    get_file_digest,
     reply_text, reply_text_paginated, reply_sticker, reply_sticker_set,
     reply_photo, reply_file, reply_keyboard, reply_callback_query,
-    send_image, update_handler, check_permission, command, FILE_TYPES
+    send_image, send_media, update_handler,
+    get_permission, check_permission, command,
+    file_id_cache, download_stats,
+    FILE_TYPES
 )
@@ -1,9 +1,61 @@
 import re
 import logging
 
+from bot.error import RegexTimeout
 
-def re_list_compile(re_list):
-    return [(re.compile(expr), repl) for expr, repl in re_list]
+
+RE_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+
+
+def re_list_compile(re_list, flags=0):
+    return [(re.compile(expr, flags), repl) for expr, repl in re_list]
+
+
+class RegexReplace:
+    def __init__(self, re_list, flags=0, worker=None):
+        self.worker = worker
+        self.flags = flags
+        self.re_list = re_list_compile(re_list, flags)
+        self.match_any = None
+        if self.re_list and not any(
+                RE_BACKREFERENCE.search(expr.pattern)
+                for expr, _ in self.re_list
+        ):
+            try:
+                self.match_any = re.compile('|'.join(
+                    '(?:%s)' % expr.pattern for expr, _ in self.re_list
+                ), flags)
+            except re.error:
+                pass
+
+    def __len__(self):
+        return len(self.re_list)
+
+    def _replace(self, string):
+        return self.worker.replace(
+            [(expr.pattern, repl) for expr, repl in self.re_list],
+            string,
+            self.flags,
+            self.match_any.pattern if self.match_any is not None else None
+        )
+
+    def __call__(self, string):
+        if not self.re_list:
+            return string
+        if self.worker is None:
+            if self.match_any is not None and not self.match_any.search(string):
+                return string
+            for expr, repl in self.re_list:
+                string = expr.sub(repl, string)
+            return string
+        try:
+            return self._replace(string)
+        except RegexTimeout:
+            self.match_any = None
+        # one expression at a time to find the one that timed out
+        for expr, repl in self.re_list:
+            string = self.worker.sub(expr.pattern, repl, string, self.flags)
+        return string
 
 def chunks(list_, size):
     for i in range(0, len(list_), size):
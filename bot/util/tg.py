@@ -1,9 +1,11 @@
 import os
 import re
+import hashlib
 import logging
 import subprocess
 from time import sleep
 from functools import wraps
+from threading import Lock, get_ident
 
 import dice
 from pony.orm import db_session
@@ -14,10 +16,12 @@ from telegram import (
     TelegramError,
     Update
 )
+from telegram.error import BadRequest
 
+from bot.cache import LRUCache
 from bot.error import BotError, CommandError
-from bot.promise import Promise, PromiseType as PT
-from bot.models import User, sqlite3
+from bot.promise import Promise, PromiseType as PT, PromiseState as PS
+from bot.models import User, sqlite3, permission_cache
 
 from .enums import Permission, CommandType
 from .string import match_command_user, strip_command
@@ -26,6 +30,18 @@ from .misc import chunks
 
 LOGGER = logging.getLogger(__name__)
 
+FILE_ID_CACHE_SIZE = 4096
+file_id_cache = LRUCache(FILE_ID_CACHE_SIZE)
+
+download_lock = Lock()
+downloads = {}
+download_stats = {
+    'downloads': 0,
+    'existing': 0,
+    'coalesced': 0,
+    'errors': 0
+}
+
 RE_COMMAND = re.compile(r'^/[^\s]+\s*')
 RE_COMMAND_USERNAME = re.compile(r'^/[^@\s]+@([^\s]+)\s*')
 
@@ -100,18 +116,54 @@ def get_file(message):
             return type_, data.file_id
     raise ValueError('%r: file not found' % message)
 
+def _download(bot, ftype, fid, fname, shared):
+    tmp = '%s.%d.%d.part' % (fname, os.getpid(), get_ident())
+    try:
+        LOGGER.info('download %s -> %s', ftype, fname)
+        bot.get_file(fid).download(tmp)
+        os.replace(tmp, fname)
+        LOGGER.info('download complete: %s -> %s', ftype, fname)
+    except BaseException as ex:
+        download_stats['errors'] += 1
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        shared.reject(ex)
+        raise
+    else:
+        download_stats['downloads'] += 1
+        shared.resolve(fname)
+    finally:
+        with download_lock:
+            del downloads[fid]
+
 def download_file(message, dirs, deferred=None, overwrite=False):
     try:
         ftype, fid, fname = None, None, None
         ftype, fid = get_file(message)
         fdir = dirs[ftype]
         fname = os.path.join(fdir, get_message_filename(message))
-        if os.path.exists(fname) and not overwrite:
+        with download_lock:
+            shared = downloads.get(fid)
+            is_owner = False
+            if shared is not None:
+                download_stats['coalesced'] += 1
+            elif os.path.exists(fname) and not overwrite:
+                download_stats['existing'] += 1
+            else:
+                shared = downloads[fid] = Promise.defer()
+                is_owner = True
+        if shared is None:
             LOGGER.info('%s file exists: %s', ftype, fname)
+        elif not is_owner:
+            LOGGER.info('download in progress: %s %s', ftype, fid)
+            shared.promise.wait()
+            if shared.promise.state == PS.REJECTED:
+                raise shared.promise.value
+            fname = shared.promise.value
         else:
-            LOGGER.info('download %s -> %s', ftype, fname)
-            message.bot.get_file(fid).download(fname)
-            LOGGER.info('download complete: %s -> %s', ftype, fname)
+            _download(message.bot, ftype, fid, fname, shared)
     except BaseException as ex:
         LOGGER.error('download error: %r -> %r: %r', ftype, fname, ex)
         if deferred is not None:
@@ -227,19 +279,57 @@ def reply_sticker_set(update, stickers, quote=False):
         sleep(0.5)
         update.message.reply_sticker(sticker=sticker.file_id, quote=quote)
 
+def get_file_digest(fname):
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_sent_file_id(message, kind):
+    if message is None:
+        return None
+    if kind == 'photo':
+        return message.photo[-1].file_id if message.photo else None
+    media = getattr(message, kind, None)
+    return media.file_id if media is not None else None
+
+def send_media(bot, send, kind, key, media):
+    if key is not None:
+        key = (bot.id, kind, key)
+        file_id = file_id_cache.get(key)
+        if file_id is not None:
+            try:
+                return send(file_id)
+            except BadRequest as ex:
+                LOGGER.info('send cached %s %s: %r', kind, file_id, ex)
+                file_id_cache.pop(key)
+    ret = send(media)
+    if key is not None:
+        file_id = get_sent_file_id(ret, kind)
+        if file_id is not None:
+            file_id_cache[key] = file_id
+    return ret
+
+def send_file(bot, send, kind, file_):
+    if not isinstance(file_, str):
+        return send_media(bot, send, kind, None, file_)
+    with open(file_, 'rb') as fp:
+        return send_media(bot, send, kind, get_file_digest(file_), fp)
+
 def reply_photo(update, img, quote=False):
-    if isinstance(img, str):
-        with open(img, 'rb') as fp:
-            update.message.reply_photo(fp, quote=quote)
-    else:
-        update.message.reply_photo(img, quote=quote)
+    return send_file(
+        update.message.bot,
+        lambda media: update.message.reply_photo(media, quote=quote),
+        'photo', img
+    )
 
 def reply_file(update, file_, quote=False):
-    if isinstance(file_, str):
-        with open(file_, 'rb') as fp:
-            update.message.reply_document(fp, quote=quote)
-    else:
-        update.message.reply_document(file_, quote=quote)
+    return send_file(
+        update.message.bot,
+        lambda media: update.message.reply_document(media, quote=quote),
+        'document', file_
+    )
 
 def reply_keyboard(update, msg, options=None):
     if isinstance(msg, tuple) and len(msg) == 2:
@@ -267,14 +357,20 @@ def reply_callback_query(update, msg):
     message = update.callback_query.message
     message.edit_text(msg)
 
-def send_image(bot, chat_id, url, *args, **kwargs):
+def send_image(bot, chat_id, url, *args, file_=None, **kwargs):
     LOGGER.debug('send_image %r %r', url, RE_ANIMATION_URL.match(url))
+    media = url if file_ is None else file_
     if RE_ANIMATION_URL.match(url):
         LOGGER.debug('send_animation')
-        bot.send_animation(chat_id, url, *args, **kwargs)
+        kind, send = 'animation', bot.send_animation
     else:
         LOGGER.debug('send_photo')
-        bot.send_photo(chat_id, url, *args, **kwargs)
+        kind, send = 'photo', bot.send_photo
+    return send_media(
+        bot,
+        lambda media: send(chat_id, media, *args, **kwargs),
+        kind, url, media
+    )
 
 
 def update_handler(method):
@@ -303,14 +399,20 @@ def update_handler(method):
 
 
 def get_permission(user):
+    try:
+        return permission_cache[user.id]
+    except KeyError:
+        pass
     with db_session:
-        return User.from_tg(user).permission
+        ret = User.from_tg(user).permission
+    permission_cache[user.id] = ret
+    return ret
 
 def check_permission(bot, user, min_value=Permission.USER):
     try:
         value = get_permission(user)
     except sqlite3.ProgrammingError:
-        get_permission_ = Promise.wrap(get_permission, ptype=PT.MANUAL)
+        get_permission_ = Promise.wrap(get_permission, user, ptype=PT.MANUAL)
         bot.queue.put(get_permission_)
         get_permission_.wait()
         value = get_permission_.value
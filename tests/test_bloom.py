@@ -0,0 +1,24 @@
+import pytest
+
+from bot.bloom import DuplicateFilter
+
+
+def test_duplicate_filter():
+    dedup = DuplicateFilter(2)
+    assert not dedup.check('Hello, world!')
+    assert dedup.check('hello   world')
+    assert not dedup.check('a')
+    assert not dedup.check('b')
+    assert dedup.check('hello world')
+    assert not dedup.check('c')
+    assert not dedup.check('d')
+    assert not dedup.check('hello world')
+    assert dedup.stats() == {'checked': 8, 'suppressed': 2}
+
+
+def test_duplicate_filter_error_rate():
+    dedup = DuplicateFilter(1000)
+    false_positives = sum(dedup.check('text %d' % i) for i in range(1000))
+    assert false_positives < 30
+    with pytest.raises(ValueError):
+        DuplicateFilter(0)
@@ -1,5 +1,115 @@
+from queue import Queue
+from threading import Lock, Thread
+from collections import deque
+from unittest.mock import Mock
 import pytest
 
 from bot.bot import Bot
+from bot.promise import Promise, PromiseState as S, PromiseType as T
 
 
+@pytest.fixture
+def bot():
+    ret = Bot.__new__(Bot)
+    ret.logger = Mock()
+    ret.queue = Queue()
+    ret.batch_size = 3
+    ret.batch_latency = 0.01
+    return ret
+
+
+def test_bot_get_batch(bot):
+    promises = [Promise.wrap(int, i, ptype=T.BATCH) for i in range(4)]
+    manual = Promise.wrap(int, 4, ptype=T.MANUAL)
+    for promise in promises[:2] + [manual] + promises[2:]:
+        bot.queue.put(promise)
+    assert bot._get_batch() == promises[:2] + [manual]
+    assert bot._get_batch() == promises[2:]
+    bot.queue.put(manual)
+    assert bot._get_batch() == [manual]
+
+
+def test_bot_run_batch(bot):
+    run = Mock(wraps=int)
+    promises = [Promise.wrap(run, i, ptype=T.BATCH) for i in range(3)]
+    manual = Promise.wrap(run, 3, ptype=T.MANUAL)
+    bot._run_batch(promises + [manual, 'invalid'])
+    assert [p._state for p in promises + [manual]] == [S.RESOLVED] * 4
+    assert [p._value for p in promises + [manual]] == [0, 1, 2, 3]
+    assert run.call_count == 4
+    bot.logger.error.assert_called_once()
+
+
+def test_bot_run_batch_error(bot):
+    run = Mock(wraps=int)
+    promises = [
+        Promise.wrap(run, value, ptype=T.BATCH)
+        for value in ('0', 'x', '2')
+    ]
+    bot._run_batch(promises)
+    assert [p._state for p in promises] == [S.RESOLVED, S.REJECTED, S.RESOLVED]
+    assert promises[0]._value == 0
+    assert isinstance(promises[1]._value, ValueError)
+    assert promises[2]._value == 2
+    assert run.call_count == 6
+
+
+@pytest.fixture
+def async_bot(bot, tmpdir):
+    bot.state = Mock()
+    bot.log_buffer = 2
+    bot.log_lock = Lock()
+    bot.log_pending = deque()
+    bot.state.get_stats.return_value = {}
+    bot.log_stats = dict.fromkeys(
+        ('logged', 'blocked', 'dropped', 'spilled', 'max_pending'), 0
+    )
+    bot.spill_path = str(tmpdir.join('spill.jsonl'))
+    return bot
+
+
+@pytest.mark.parametrize('overflow,stats', [
+    ('drop', {'logged': 2, 'dropped': 1, 'spilled': 0}),
+    ('spill', {'logged': 2, 'dropped': 0, 'spilled': 1})
+])
+def test_bot_log_update_overflow(async_bot, overflow, stats):
+    async_bot.log_overflow = overflow
+    updates = [Mock(**{'to_json.return_value': '{"update_id": %d}' % i})
+               for i in range(3)]
+    for update in updates:
+        async_bot.log_update(update)
+    assert async_bot.queue.qsize() == 2
+    assert async_bot.get_stats()['update log']['pending'] == 2
+    for key, value in stats.items():
+        assert async_bot.log_stats[key] == value
+    if overflow == 'spill':
+        with open(async_bot.spill_path) as fp:
+            assert fp.read() == '{"update_id": 2}\n'
+
+    async_bot._run_batch([async_bot.queue.get() for _ in range(2)])
+    async_bot.log_update(updates[0])
+    assert async_bot.get_stats()['update log']['pending'] == 1
+    assert async_bot.log_stats['max_pending'] == 2
+
+
+def test_bot_log_update_unknown(async_bot):
+    async_bot.state.is_known.return_value = False
+    async_bot.state.learn_update.side_effect = ValueError('learn')
+    update = Mock()
+    thread = Thread(target=async_bot.log_update, args=(update,))
+    thread.start()
+    async_bot._run_batch([async_bot.queue.get(timeout=1)])
+    thread.join(1)
+    assert not thread.is_alive()
+    async_bot.state.learn_update.assert_called_once_with(update)
+    async_bot.logger.error.assert_called_once()
+    assert not async_bot.log_pending
+
+
+def test_bot_log_update_error_logged(async_bot):
+    async_bot.log_overflow = 'drop'
+    async_bot.state.learn_update.side_effect = ValueError('learn')
+    async_bot.log_update(Mock())
+    assert async_bot.queue.qsize() == 1
+    async_bot._run_batch([async_bot.queue.get()])
+    async_bot.logger.error.assert_called_once()
@@ -0,0 +1,51 @@
+from time import sleep
+from unittest.mock import Mock
+import pytest
+
+from bot.cache import LRUCache
+
+
+def test_lru_cache():
+    on_evict = Mock()
+    cache = LRUCache(2, on_evict=on_evict)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    on_evict.assert_called_once_with('b', 2)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.keys() == ['a', 'c']
+    assert cache.pop('a') == 1
+    assert cache.pop('a', 0) == 0
+    with pytest.raises(KeyError):
+        cache['a']
+    assert cache.stats() == {
+        'size': 1,
+        'max_size': 2,
+        'hits': 1,
+        'misses': 2,
+        'evictions': 1
+    }
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lru_cache_ttl():
+    on_evict = Mock()
+    cache = LRUCache(None, ttl=0.05, on_evict=on_evict)
+    cache['a'] = 1
+    assert cache['a'] == 1
+    sleep(0.06)
+    cache['b'] = 2
+    assert cache.get('a') is None
+    on_evict.assert_called_once_with('a', 1)
+    assert cache.values() == [2]
+    sleep(0.06)
+    cache.expire()
+    assert len(cache) == 0
+
+
+def test_lru_cache_size():
+    with pytest.raises(ValueError):
+        LRUCache(0)
@@ -0,0 +1,51 @@
+import pytest
+
+from markovchain.text import MarkovText
+from markovchain.storage import SqliteStorage
+
+from bot.context import Context
+from bot.compact_markov import CompactStorage, export
+
+
+@pytest.fixture
+def root(tmpdir):
+    ret = tmpdir.mkdir('test_ro')
+    markov = MarkovText.from_storage(
+        SqliteStorage(db=str(ret.join('markov.db')), settings={})
+    )
+    for text in ('a b c', 'a b d', 'b d e', 'f'):
+        markov.data(text)
+    markov.save()
+    markov.close()
+    export(str(ret.join('markov.db')), str(ret.join('markov.bin')))
+    return ret
+
+
+def test_compact_markov_links(root):
+    src = SqliteStorage.load(str(root.join('markov.db')))
+    dst = CompactStorage.load(str(root.join('markov.bin')))
+    src_dataset = src.get_dataset('_ss1')
+    dst_dataset = dst.get_dataset('_ss1')
+    for word in ('', 'a', 'b', 'd', 'f', 'x'):
+        src_state = src.get_state([word], 1)
+        dst_state = dst.get_state([word], 1)
+        assert (src_state is None) == (dst_state is None)
+        for backward in (False, True):
+            src_links = src.get_links(src_dataset, src_state, backward)
+            dst_links = dst.get_links(dst_dataset, dst_state, backward)
+            assert (sorted(link[:2] for link in src_links)
+                    == sorted(link[:2] for link in dst_links))
+    assert sorted(src.get_states('_ss1', 'b')) == dst.get_states('_ss1', 'b')
+    with pytest.raises(KeyError):
+        dst.get_dataset('_ss2')
+    with pytest.raises(ValueError):
+        dst.add_links([])
+    src.close()
+    dst.close()
+
+
+def test_compact_markov_context(root):
+    ctx = Context(str(root), {})
+    assert isinstance(ctx.markov.storage, CompactStorage)
+    assert ctx.random_text(1, 10).endswith('.')
+    ctx.close()
@@ -0,0 +1,141 @@
+import json
+from time import sleep
+from threading import Thread
+from unittest.mock import Mock
+import pytest
+
+from bot.context_cache import ContextCache
+from bot.error import ContextClosed
+
+
+@pytest.fixture
+def cache(tmpdir):
+    settings = tmpdir.mkdir('settings')
+    settings.join('markov.json').write(json.dumps({}))
+    ret = ContextCache(str(tmpdir.mkdir('data')), max_size=2)
+    yield ret
+    ret.close()
+
+
+def test_context_cache_evict(cache):
+    chats = [Mock(id=i) for i in range(3)]
+    contexts = [cache.get_private(chat) for chat in chats]
+    assert contexts[0].markov is None
+    assert contexts[1].markov is not None
+    assert '0' not in cache
+    contexts[1].learn_text('a b c')
+
+    ctx = cache.get('0')
+    assert ctx is not contexts[0]
+    assert ctx.markov is not None
+    assert contexts[1].markov is None
+    with pytest.raises(ContextClosed):
+        contexts[1].random_text(1, 10)
+    with pytest.raises(ContextClosed):
+        contexts[1].learn_text('a b c')
+    assert cache.get('1').random_text(1, 10) == 'A b c.'
+
+    stats = cache.stats()
+    assert stats['size'] == 2
+    assert stats['evictions'] == 3
+    assert stats['loads'] == 2
+
+
+def test_context_cache_delete_private(cache):
+    chat = Mock(id=1)
+    ctx = cache.get_private(chat)
+    cache.delete_private(chat)
+    assert ctx.markov is None
+    assert '1' not in cache
+    with pytest.raises(FileNotFoundError):
+        cache.get('1')
+
+
+def test_context_cache_has_private(cache, tmpdir):
+    tmpdir.join('data', 'private').mkdir('2')
+    cache = ContextCache(str(tmpdir.join('data')), max_size=2)
+    chat = Mock(id=1)
+    assert cache.has_private(Mock(id=2))
+    assert not cache.has_private(chat)
+    assert cache.list(1) == ['new private context']
+    cache.get_private(chat)
+    assert cache.has_private(chat)
+    assert cache.list(1) == ['1']
+    cache.delete_private(chat)
+    assert not cache.has_private(chat)
+    cache.close()
+
+
+def test_context_learn_buffer(cache):
+    ctx = cache.get_private(Mock(id=1))
+    ctx.learn_buffer = 2
+    ctx.learn_interval = 60
+    ctx.learn_text('a b')
+    assert ctx.learn_pending == ['a b']
+    with pytest.raises(KeyError):
+        ctx.random_text(1, 10)
+    ctx.learn_text('a b')
+    assert ctx.learn_pending == []
+    assert ctx.random_text(1, 10) == 'A b.'
+
+    ctx.learn_text('c d')
+    cache.flush(False)
+    assert ctx.learn_pending == ['c d']
+    ctx.learn_interval = 0
+    cache.flush(False)
+    assert ctx.learn_pending == []
+
+    ctx.learn_interval = 60
+    ctx.learn_text('e f')
+    cache.close()
+    assert ctx.learn_pending == []
+
+
+def test_context_pool(cache):
+    ctx = cache.get_private(Mock(id=1))
+    ctx.pool_size = 2
+    ctx.learn_text('foo bar')
+    assert ctx.random_text(1, 10) == 'Foo bar.'
+    assert cache.refill() == 2
+    assert len(ctx.pool[(1, 10)]) == 2
+    assert ctx.random_text(1, 10) == 'Foo bar.'
+    ctx.reply_text('xyz', 1, 10)
+    assert len(ctx.pool[(1, 10)]) == 1
+    assert ctx.reply_text('bar', 1, 10) == 'Foo bar.'
+    assert not ctx.pool[(1, 10)]
+    assert cache.refill() == 2
+
+    ctx.learn_text('baz')
+    assert not ctx.pool[(1, 10)]
+    stats = cache.stats()
+    assert stats['pool_hits'] == 1
+    assert stats['pool_misses'] == 1
+    assert stats['pool_reply_hits'] == 1
+    assert stats['pool_reply_misses'] == 1
+    assert stats['pool_generated'] == 4
+    assert stats['pool_invalidated'] == 2
+    assert stats['pool_size'] == 0
+
+
+def test_context_cache_concurrent_load(cache, monkeypatch):
+    cache.get_private(Mock(id=1))
+    cache.context.clear()
+    loaded = []
+
+    def load(*args):
+        sleep(0.05)
+        loaded.append(Mock())
+        return loaded[-1]
+
+    monkeypatch.setattr('bot.context_cache.Context', load)
+    res = []
+    threads = [
+        Thread(target=lambda: res.append(cache.get('1')))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loaded) == 1
+    assert res == loaded * 4
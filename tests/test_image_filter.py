@@ -0,0 +1,39 @@
+import io
+import json
+import os
+import pytest
+
+from bot.image_filter import parse_size, filter_image
+
+
+SETTINGS = os.path.join(
+    os.path.dirname(__file__), '..', '.bot', 'settings', 'filter.json'
+)
+
+
+@pytest.mark.parametrize('test,res', [
+    ('384x384', (384, 384)),
+    ('200X100', (200, 100)),
+    ('64', (64, 64)),
+    (32, (32, 32))
+])
+def test_parse_size(test, res):
+    assert parse_size(test) == res
+
+
+@pytest.mark.parametrize('test', ['x', '0x10', '-1x1'])
+def test_parse_size_error(test):
+    with pytest.raises(ValueError):
+        parse_size(test)
+
+
+def test_filter_image():
+    image = pytest.importorskip('PIL.Image')
+    img = image.new('RGB', (200, 100), (255, 0, 0))
+    data = io.BytesIO()
+    img.save(data, 'png')
+    with open(SETTINGS) as fp:
+        settings = json.load(fp)
+    res = image.open(io.BytesIO(filter_image(data.getvalue(), '64x64', settings)))
+    assert res.format == 'JPEG'
+    assert res.size[0] <= 64 and res.size[1] <= 64
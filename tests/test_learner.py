@@ -0,0 +1,28 @@
+import json
+from unittest.mock import Mock
+import pytest
+
+from bot.context_cache import ContextCache
+from bot.learner import Learner
+
+
+@pytest.fixture
+def learner():
+    ret = Learner(2)
+    yield ret
+    ret.close()
+
+
+def test_learner(learner, tmpdir):
+    settings = tmpdir.mkdir('settings')
+    settings.join('markov.json').write(json.dumps({}))
+    cache = ContextCache(str(tmpdir.mkdir('data')), learner=learner)
+    ctx = cache.get_private(Mock(id=1))
+    ctx.learn_text('a b c')
+    ctx.learn_text('a b c')
+    learner.close()
+    assert ctx.random_text(1, 10) == 'A b c.'
+    stats = learner.stats()
+    assert stats['batches'] == 2
+    assert stats['texts'] == 2
+    cache.close()
@@ -0,0 +1,41 @@
+import os
+from unittest.mock import Mock
+import pytest
+
+from bot.media_cache import MediaCache
+
+
+@pytest.fixture
+def http():
+    def request(method, url, **_):
+        return Mock(status=200, data=url.encode('utf-8')[-4:] * 4)
+    return Mock(request=Mock(side_effect=request))
+
+
+def test_media_cache(tmpdir, http):
+    cache = MediaCache(str(tmpdir), http, max_size=40)
+    assert cache.get('http://a/1111') is None
+    path = cache.fetch('http://a/1111')
+    assert cache.get('http://a/1111') == path
+    with open(path, 'rb') as fp:
+        assert fp.read() == b'1111' * 4
+    assert cache.fetch('http://b/1111') == path
+
+    cache.fetch('http://a/2222')
+    cache.get('http://a/1111')
+    cache.fetch('http://a/3333')
+    assert cache.get('http://a/2222') is None
+    assert cache.get('http://b/1111') == path
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['size'] == 32
+    cache.close()
+
+
+def test_media_cache_prewarm(tmpdir, http):
+    cache = MediaCache(str(tmpdir), http)
+    cache.prewarm(['http://a/1111', 'http://a/2222', 'http://a/1111'])
+    cache.executor.shutdown(wait=True)
+    assert http.request.call_count == 2
+    assert os.path.exists(cache.get('http://a/2222'))
+    assert cache.stats()['pending'] == 0
+    cache.close()
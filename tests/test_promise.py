@@ -256,3 +256,28 @@ def test_promise_chain_depth(length, reject_i, error):
     assert i == reject_i
     assert run.call_count == i if reject_i >= length else i + 1
     assert start._state == S.RESOLVED
+
+
+def test_promise_call_settle():
+    run = Mock(wraps=lambda resolve, reject: resolve(2))
+    p = Promise(run, T.BATCH)
+    assert not p.wait(0.01)
+    assert p.call() == (S.RESOLVED, 2)
+    assert p._state == S.PENDING
+    assert not p._event.is_set()
+    p.settle(S.RESOLVED, 2)
+    assert p._state == S.RESOLVED
+    assert p._value == 2
+    assert p.wait(0.01)
+    assert p.call() == (S.RESOLVED, 2)
+    assert run.call_count == 1
+
+
+def test_promise_call_error():
+    p = Promise(lambda *_: int('x'), T.BATCH)
+    state, value = p.call()
+    assert state == S.REJECTED
+    assert isinstance(value, ValueError)
+    state, value = Promise(lambda *_: None, T.BATCH).call()
+    assert state == S.REJECTED
+    assert isinstance(value, PromiseStateNotSet)
@@ -0,0 +1,27 @@
+import json
+
+from bot.context import Context
+from bot.prune_context import compact
+
+
+def test_prune_context(tmpdir):
+    settings = tmpdir.join('markov.json')
+    settings.write(json.dumps({}))
+    ctx = Context.create(str(tmpdir.join('ctx')), str(settings))
+    for text in ('a b', 'a b', 'a b', 'c d'):
+        ctx.learn_text(text)
+    ino = ctx.markov_ino
+
+    res = compact(str(tmpdir.join('ctx', 'markov.db')), 2, 5)
+    assert res['links'] == (10, 4)
+    assert res['nodes'] == (6, 4)
+    assert set(res) == {'links', 'nodes', 'size', 'latency'}
+
+    assert ctx.random_text(1, 10) == 'A b.'
+    assert ctx.markov_ino != ino
+    ctx.learn_text('a b')
+    links = ctx.markov.storage.db.execute(
+        'SELECT count FROM links ORDER BY count'
+    ).fetchall()
+    assert links == [(1,), (4,), (4,), (4,), (4,)]
+    ctx.close()
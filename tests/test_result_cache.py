@@ -0,0 +1,35 @@
+from time import sleep
+
+from bot.result_cache import ResultCache
+
+
+def test_result_cache(tmpdir):
+    cache = ResultCache(str(tmpdir.mkdir('cache')), max_size=20)
+    src = tmpdir.join('input')
+    src.write('image')
+    key = cache.key('ocr', str(src), 'eng', ext='txt')
+    assert key.endswith('.txt')
+    assert key == cache.key('ocr', str(src), 'eng', ext='txt')
+    assert key != cache.key('ocr', str(src), 'rus', ext='txt')
+    assert key != cache.key('filter', str(src), 'eng', ext='txt')
+    assert cache.get(key) is None
+    path = cache.save(key, b'0123456789')
+    assert cache.get(key) == path
+    with open(path, 'rb') as fp:
+        assert fp.read() == b'0123456789'
+
+    sleep(0.01)
+    src.write('other image')
+    assert key != cache.key('ocr', str(src), 'eng', ext='txt')
+
+    key2 = cache.key('ocr', str(src), 'eng')
+    cache.save(key2, b'0123456789')
+    cache.get(key)
+    cache.save('key3', b'0123456789')
+    assert cache.get(key2) is None
+    assert cache.get(key) == path
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['size'] == 20
+    assert stats['hits'] == 3
+    cache.close()
@@ -0,0 +1,75 @@
+import re
+import pytest
+
+from bot.error import RegexError, RegexTimeout
+from bot.safe_regex import check_regex, RegexWorker
+from bot.util import RegexReplace
+
+
+@pytest.mark.parametrize('test,ok', [
+    (r'^/test\b', True),
+    (r'(foo|bar)+', True),
+    (r'a+b*c?', True),
+    (r'(a{1,3})+', True),
+    (r'(a+)+$', False),
+    (r'(\w+\s?)*$', False),
+    (r'(?:x|(?:y*)+)', False),
+    (r'(?=(a+)+)', False),
+    (r'(', False),
+    ('a' * 1000, False)
+])
+def test_check_regex(test, ok):
+    if ok:
+        check_regex(test, re.I)
+    else:
+        with pytest.raises(RegexError):
+            check_regex(test, re.I)
+
+
+@pytest.fixture(scope='module')
+def worker():
+    ret = RegexWorker(0.5)
+    yield ret
+    ret.close()
+
+
+def test_regex_worker(worker):
+    assert worker.search('B', 'abc', re.I)
+    assert not worker.search('d', 'abc')
+    assert worker.sub('b', 'x', 'abc') == 'axc'
+    with pytest.raises(re.error):
+        worker.search('(', 'abc')
+    with pytest.raises(RegexTimeout):
+        worker.search(r'(a+)+$', 'a' * 40 + 'b')
+    assert worker.process is None
+    assert worker.sub('b', 'x', 'abc') == 'axc'
+    assert worker.stats()['timeouts'] == 1
+
+
+def test_regex_replace_worker(worker):
+    replace = RegexReplace([('x', 'y'), (r'(a+)+$', '')], 0, worker)
+    assert replace('b') == 'b'
+    with pytest.raises(RegexTimeout) as ex:
+        replace('x' + 'a' * 40 + 'b')
+    assert ex.value.args[0] == r'(a+)+$'
+
+
+def test_regex_worker_restart(worker):
+    assert worker.search('a', 'abc')
+    worker.process.kill()
+    worker.process.join()
+    with pytest.raises(RegexError):
+        worker.search('a', 'abc')
+    assert worker.process is None
+    assert worker.search('a', 'abc')
+    assert worker.stats()['errors'] == 1
+
+
+def test_regex_worker_replace(worker):
+    re_list = [('b', 'x'), ('x', 'y')]
+    assert worker.replace(re_list, 'abc') == 'ayc'
+    assert worker.replace(re_list, 'abc', match_any='d') == 'abc'
+    replace = RegexReplace(re_list, re.I, worker)
+    calls = worker.stats()['calls']
+    assert replace('aBc') == 'ayc'
+    assert worker.stats()['calls'] == calls + 1
@@ -0,0 +1,104 @@
+import os
+import sys
+import shutil
+import subprocess
+import pytest
+
+from bot.script_pool import ScriptPool
+
+
+SCRIPTS = os.path.join(os.path.dirname(__file__), '..', '.bot', 'scripts')
+
+WORKER = '''#!%s
+import os
+import sys
+import time
+import script_worker
+
+
+def main():
+    if sys.argv[1] == 'sleep':
+        time.sleep(float(sys.argv[2]))
+    if sys.argv[1] == 'fail':
+        sys.exit(3)
+    print(os.getpid(), *sys.argv[1:])
+
+
+if __name__ == '__main__':
+    script_worker.run(main)
+''' % sys.executable
+
+ONESHOT = '''#!/bin/sh
+echo "$@" >> "$(dirname "$0")/oneshot.log"
+echo "$@"
+'''
+
+STREAM = '''#!/bin/sh
+echo 1
+sleep 0.2
+echo 2
+sleep "$1"
+exit 1
+'''
+
+
+@pytest.fixture
+def pool(tmpdir):
+    root = str(tmpdir)
+    shutil.copy(os.path.join(SCRIPTS, 'script_worker.py'), root)
+    for name, text in (('worker', WORKER), ('oneshot', ONESHOT),
+                       ('stream', STREAM)):
+        fname = os.path.join(root, name)
+        with open(fname, 'w') as fp:
+            fp.write(text)
+        os.chmod(fname, 0o755)
+    pool = ScriptPool(root, 10, 1)
+    yield pool
+    pool.close()
+
+
+def test_script_pool_worker(pool):
+    pid, arg = pool.run('worker', ['a']).decode('utf-8').split()
+    assert arg == 'a'
+    assert pool.run('worker', ['b']).decode('utf-8').split() == [pid, 'b']
+    with pytest.raises(subprocess.CalledProcessError) as ex:
+        pool.run('worker', ['fail'])
+    assert ex.value.returncode == 3
+    assert pool.run('worker', ['c']).decode('utf-8').split() == [pid, 'c']
+    stats = pool.stats()
+    assert stats['started'] == 1
+    assert stats['idle'] == 1
+    assert stats['oneshot'] == 0
+
+
+def test_script_pool_timeout(pool):
+    pid = pool.run('worker', ['a']).split()[0]
+    with pytest.raises(subprocess.TimeoutExpired):
+        pool.run('worker', ['sleep', '5'], 0.5)
+    assert pool.stats()['timeouts'] == 1
+    assert pool.run('worker', ['a']).split()[0] != pid
+
+
+def test_script_pool_oneshot(pool):
+    assert pool.run('oneshot', ['a', 'b']) == b'a b\n'
+    assert pool.run('oneshot', ['c']) == b'c\n'
+    with open(os.path.join(pool.root, 'oneshot.log')) as fp:
+        assert fp.read() == 'a b\nc\n'
+    stats = pool.stats()
+    assert stats['oneshot'] == 2
+    assert stats['started'] == 0
+
+
+def test_script_pool_stream(pool):
+    chunks = []
+    with pytest.raises(subprocess.CalledProcessError) as ex:
+        for data in pool.stream('stream', ['0']):
+            chunks.append(data)
+    assert chunks == [b'1\n', b'2\n']
+    assert ex.value.output == b'1\n2\n'
+    with pytest.raises(subprocess.TimeoutExpired):
+        for data in pool.stream('stream', ['5'], 0.5):
+            pass
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['errors'] == 1
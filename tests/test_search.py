@@ -0,0 +1,103 @@
+from time import time
+from threading import Thread, Event
+
+from bot.search import (
+    Search, SearchCache, SearchResults, SearchResult, TokenBucket,
+    normalize_query
+)
+
+
+def get_results(n, **kwargs):
+    return SearchResults([
+        SearchResult(i, 'thumb%d' % i, 'image%d' % i, 'url%d' % i, 'title')
+        for i in range(n)
+    ], **kwargs)
+
+
+def test_normalize_query():
+    assert normalize_query('  Foo \tBAR ') == 'foo bar'
+
+
+def test_search_cache(tmpdir):
+    path = str(tmpdir.join('search.db'))
+    cache = SearchCache(2, 60, path, max_disk_size=2)
+    results = cache.get('a')
+    assert not results.items
+    assert cache.get('a') is results
+    cache.save('a', get_results(2, next_url='next'))
+    cache.save('b', get_results(1, full=True))
+    cache.save('c', get_results(1, full=True))
+    cache.close()
+
+    cache = SearchCache(2, 60, path)
+    assert not cache.get('a').items
+    results = cache.get('b')
+    assert len(results) == 1
+    assert results.full
+    assert results[0].image == 'image0'
+    assert results[0].filename == get_results(1)[0].filename
+    stats = cache.stats()
+    assert stats['disk_size'] == 2
+    assert stats['disk_hits'] == 1
+    assert stats['disk_misses'] == 1
+    cache.close()
+
+    cache = SearchCache(2, 0, path)
+    assert not cache.get('b').items
+    cache.close()
+
+
+def test_token_bucket():
+    bucket = TokenBucket(20, 2)
+    start = time()
+    for _ in range(4):
+        bucket.acquire()
+    assert 0.09 < time() - start < 0.5
+    stats = bucket.stats()
+    assert stats['waits'] == 2
+
+
+def test_search_query_lock(mocker):
+    search = Search()
+    started = Event()
+    release = Event()
+
+    def request(query, results):
+        if query == 'slow':
+            started.set()
+            release.wait(5)
+        results.items.extend(get_results(2).items)
+        results.full = True
+
+    mocker.patch.object(search, '_request', side_effect=request)
+    thread = Thread(target=search, args=('slow', 0))
+    thread.start()
+    assert started.wait(5)
+    assert search('fast', 1) == (search['fast'][1], True)
+    assert thread.is_alive()
+    release.set()
+    thread.join()
+    assert not search.query_locks
+
+
+def test_search_prefetch(mocker):
+    search = Search(prefetch=1)
+    release = Event()
+
+    def request(query, results):
+        if results.items:
+            release.wait(5)
+        results.items.extend(get_results(2).items)
+        results.full = len(results.items) >= 4
+        results.next_url = None if results.full else 'next'
+
+    mocker.patch.object(search, '_request', side_effect=request)
+    assert search('a', 0) == (search['a'][0], False)
+    assert search['a'].pending is None
+    assert search('a', 1) == (search['a'][1], False)
+    assert search['a'].pending is not None
+    release.set()
+    assert search('a', 2)[1] is False
+    assert search('a', 3)[1] is True
+    assert search._request.call_count == 2
+    assert search.prefetch_stats['started'] == 1
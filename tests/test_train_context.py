@@ -0,0 +1,45 @@
+import json
+
+from markovchain.text import MarkovText
+from markovchain.storage import SqliteStorage
+
+from bot import train_context
+
+
+def get_links(db):
+    return sorted(db.execute(
+        'SELECT d.key, s.value, t.value, l.value, l.bvalue, sum(l.count)'
+        ' FROM links l'
+        ' JOIN datasets d ON d.id = l.dataset'
+        ' JOIN nodes s ON s.id = l.source'
+        ' LEFT JOIN nodes t ON t.id = l.target'
+        ' GROUP BY 1, 2, 3, 4, 5'
+    ).fetchall(), key=repr)
+
+
+def test_train_context_merge(tmpdir):
+    texts = ['a b c', 'a b d', 'b d e', 'f', 'a b c']
+    settings = tmpdir.join('markov.json')
+    settings.write(json.dumps({}))
+
+    markov = MarkovText.from_storage(
+        SqliteStorage(db=str(tmpdir.join('expected.db')), settings={})
+    )
+    for text in texts:
+        markov.data(text)
+    markov.save()
+
+    db, settings = train_context.open_context(
+        str(tmpdir.join('context')), str(settings)
+    )
+    train_context._init_worker(settings)
+    links = train_context.tokenize(texts[:2])
+    train_context.merge_links(db, links, 'key', 2)
+    links = train_context.tokenize(texts[2:])
+    train_context.merge_links(db, links, 'key', 5)
+
+    assert train_context.get_progress(db, 'key') == 5
+    assert train_context.get_progress(db, 'other') == 0
+    assert get_links(db) == get_links(markov.storage.db)
+    db.close()
+    markov.close()
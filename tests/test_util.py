@@ -1,4 +1,7 @@
+import os
 import re
+from time import sleep
+from threading import Thread
 from unittest.mock import Mock
 import pytest
 
@@ -9,12 +12,24 @@ from bot.util import (
     intersperse_printable,
     flatten_html,
     re_list_compile,
+    RegexReplace,
     remove_control_chars,
     strip_command,
     match_command_user,
     sanitize_log,
-    get_chat_title
+    get_chat_title,
+    get_permission,
+    check_permission,
+    send_media,
+    send_image,
+    reply_photo,
+    download_file,
+    file_id_cache,
+    Permission as P
 )
+from telegram.error import BadRequest
+from bot.models import permission_cache
+from bot.promise import Promise
 
 
 @pytest.mark.parametrize('test,res', [
@@ -89,6 +104,22 @@ def test_re_list_compile(test):
     assert res == test
 
 
+@pytest.mark.parametrize('re_list,fast,test,res', [
+    ([], False, 'abc', 'abc'),
+    ([('^/a', '/b'), ('^/b', '/c')], True, '/a x', '/c x'),
+    ([('^/a', '/b'), ('^/b', '/c')], True, '/x a', '/x a'),
+    ([('X', 'y')], True, 'axb', 'ayb'),
+    ([(r'(a)\1', 'b'), ('c', 'd')], False, 'aac', 'bd'),
+    ([(r'(?P<x>a)(?P=x)', 'b')], False, 'aa', 'b'),
+    ([('a', 'b'), ('(?i)b', 'c')], False, 'a', 'c')
+])
+def test_regex_replace(re_list, fast, test, res):
+    replace = RegexReplace(re_list, re.I)
+    assert len(replace) == len(re_list)
+    assert (replace.match_any is not None) == fast
+    assert replace(test) == res
+
+
 @pytest.mark.parametrize('test,res', [
     (' aб\r\nb c d\u200b\u007f\U000f0000\udc00.,/?\U0001f923',
      ' aбb c d.,/?\U0001f923')
@@ -146,3 +177,113 @@ def test_sanitize_log(test, is_msg, res):
 ])
 def test_get_chat_title(test, res):
     assert get_chat_title(test) == res
+
+
+@pytest.mark.parametrize('value,min_value,res', [
+    (P.USER, P.USER, (True, True)),
+    (P.USER, P.ADMIN, (False, True)),
+    (P.IGNORED, P.IGNORED, (True, False)),
+    (P.ROOT, P.ADMIN, (True, True))
+])
+def test_check_permission_cached(value, min_value, res):
+    permission_cache.clear()
+    permission_cache[1] = value
+    hits = permission_cache.hits
+    user = Mock(id=1)
+    assert get_permission(user) == value
+    assert check_permission(Mock(), user, min_value) == res
+    assert permission_cache.hits == hits + 2
+    permission_cache.clear()
+
+
+def test_send_media_file_id_cache():
+    file_id_cache.clear()
+    bot = Mock(id=1)
+    sent = []
+
+    def send(media):
+        sent.append(media)
+        if media == 'bad':
+            raise BadRequest('wrong file identifier')
+        return Mock(photo=[Mock(file_id='small'), Mock(file_id='large')])
+
+    media = Mock()
+    send_media(bot, send, 'photo', 'key', media)
+    assert sent[-1] is media
+    send_media(bot, send, 'photo', 'key', media)
+    assert sent[-1] == 'large'
+    send_media(Mock(id=2), send, 'photo', 'key', media)
+    assert sent[-1] is media
+
+    file_id_cache[(1, 'photo', 'key')] = 'bad'
+    send_media(bot, send, 'photo', 'key', media)
+    assert sent[-2:] == ['bad', media]
+    assert file_id_cache[(1, 'photo', 'key')] == 'large'
+    file_id_cache.clear()
+
+
+def test_send_image_url():
+    file_id_cache.clear()
+    url = 'https://example.com/a.jpg'
+    bot = Mock(id=1)
+    bot.send_photo.return_value = Mock(photo=[Mock(file_id='id')])
+    send_image(bot, 5, url, caption='q')
+    bot.send_photo.assert_called_with(5, url, caption='q')
+    send_image(bot, 5, url, caption='q')
+    bot.send_photo.assert_called_with(5, 'id', caption='q')
+    file_id_cache.clear()
+
+
+def test_reply_photo_path(tmpdir):
+    file_id_cache.clear()
+    fname = str(tmpdir.join('img'))
+    with open(fname, 'wb') as fp:
+        fp.write(b'data')
+    update = Mock()
+    update.message.bot.id = 1
+    update.message.reply_photo.return_value = Mock(photo=[Mock(file_id='id')])
+    reply_photo(update, fname)
+    assert update.message.reply_photo.call_args[0][0].name == fname
+    reply_photo(update, fname)
+    update.message.reply_photo.assert_called_with('id', quote=False)
+    file_id_cache.clear()
+
+
+@pytest.mark.parametrize('error', [False, True])
+def test_download_file_coalesced(tmpdir, error):
+    def download(fname):
+        sleep(0.2)
+        if error:
+            raise IOError('download error')
+        with open(fname, 'w') as fp:
+            fp.write('data')
+
+    message = Mock(
+        video=None, video_note=None, audio=None, voice=None,
+        document=Mock(file_id='file')
+    )
+    message.date.timestamp.return_value = 0
+    message.bot.get_file.return_value.download.side_effect = download
+    deferreds = [Promise.defer() for _ in range(3)]
+
+    def run(deferred):
+        try:
+            download_file(message, {'document': str(tmpdir)}, deferred)
+        except IOError:
+            pass
+
+    threads = [Thread(target=run, args=(deferred,)) for deferred in deferreds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert message.bot.get_file.call_count == 1
+    values = set(deferred.promise.value for deferred in deferreds)
+    assert len(values) == 1
+    if error:
+        assert isinstance(values.pop(), IOError)
+    else:
+        with open(values.pop()) as fp:
+            assert fp.read() == 'data'
+    assert not [fname for fname in os.listdir(str(tmpdir))
+                if fname.endswith('.part')]